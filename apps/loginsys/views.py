@@ -2,9 +2,31 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+import logging
 from .forms import SignupForm
+from apps.store.cart import merge_cookie_cart
 from apps.store.models import Customer
 
+logger = logging.getLogger(__name__)
+
+
+def _merge_cart_on_login(request, user, response):
+    """Merge the cart cookie into the user's cart and clear it.
+
+    A failed merge is logged and the cookie kept, so the login still goes
+    through and nothing in the anonymous cart is lost.
+    """
+    if 'cart' not in request.COOKIES:
+        return response
+    try:
+        merge_cookie_cart(request, user)
+    except Exception as e:
+        logger.error(f"Failed to merge cart cookie for user {user.id}: {str(e)}")
+        return response
+    response.set_cookie('cart', '{}', max_age=0)
+    return response
+
+
 def loginUser(request):
     if request.method == 'POST':
         username = request.POST.get('username', '').strip()
@@ -20,9 +42,7 @@ def loginUser(request):
             login(request, user)
             # Redirect to 'next' URL if provided (e.g., from @staff_member_required)
             next_url = request.GET.get('next') or request.POST.get('next', '')
-            if next_url:
-                return redirect(next_url)
-            return redirect('store')
+            return _merge_cart_on_login(request, user, redirect(next_url or 'store'))
         else:
             messages.error(request, 'Invalid username or password')
 
@@ -46,7 +66,7 @@ def registerUser(request):
                 user = form.save()
                 login(request, user)
                 messages.success(request, 'Account created successfully!')
-                return redirect('store')
+                return _merge_cart_on_login(request, user, redirect('store'))
             except Exception as e:
                 messages.error(request, f'Error creating account: {str(e)}')
         else:
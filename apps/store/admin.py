@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Product, Customer, Order, OrderItem, ShippingAddress
+from django.db.models import Count, Q
+from .models import Product, Customer, Order, OrderItem, ShippingAddress, Job, DailySalesRollup
 
 # Customize admin site headers
 admin.site.site_header = "Phone Store Admin"
@@ -12,11 +13,18 @@ class CustomerAdmin(admin.ModelAdmin):
     search_fields = ['name', 'email']
     list_filter = ['user__date_joined']
     readonly_fields = ['get_total_orders']
+    list_select_related = ['user']
     list_per_page = 25
     
+    def get_queryset(self, request):
+        # Count completed orders in the list query rather than once per row
+        qs = super().get_queryset(request)
+        return qs.annotate(completed_orders=Count('order', filter=Q(order__complete=True)))
+    
     def get_total_orders(self, obj):
-        return obj.order_set.filter(complete=True).count()
+        return obj.completed_orders
     get_total_orders.short_description = 'Total Orders'
+    get_total_orders.admin_order_field = 'completed_orders'
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -54,15 +62,18 @@ class ProductAdmin(admin.ModelAdmin):
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
-    readonly_fields = ['get_total']
-    fields = ['product', 'quantity', 'get_total']
+    readonly_fields = ['unit_price', 'get_total']
+    fields = ['product', 'quantity', 'unit_price', 'get_total']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['transaction_id', 'customer', 'date_ordered', 'status', 'complete', 'get_cart_total', 'payment_verified']
+    list_display = ['transaction_id', 'customer', 'date_ordered', 'status', 'complete', 'item_count', 'order_total', 'payment_verified']
     list_filter = ['complete', 'status', 'date_ordered']
     search_fields = ['transaction_id', 'customer__name', 'customer__email']
-    readonly_fields = ['date_ordered', 'get_cart_total', 'get_cart_items', 'transaction_id', 'razorpay_payment_id']
+    readonly_fields = ['date_ordered', 'completed_at', 'get_cart_total', 'get_cart_items', 'transaction_id', 'razorpay_payment_id']
     inlines = [OrderItemInline]
     actions = ['mark_processing', 'mark_shipped', 'mark_delivered']
     fieldsets = (
@@ -73,10 +84,11 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('transaction_id', 'razorpay_payment_id')
         }),
         ('Order Summary', {
-            'fields': ('get_cart_total', 'get_cart_items', 'date_ordered'),
+            'fields': ('get_cart_total', 'get_cart_items', 'date_ordered', 'completed_at'),
             'classes': ('collapse',)
         })
     )
+    list_select_related = ['customer']
     list_per_page = 25
     
     def get_queryset(self, request):
@@ -84,6 +96,11 @@ class OrderAdmin(admin.ModelAdmin):
         qs = super().get_queryset(request)
         return qs.filter(complete=True, razorpay_payment_id__isnull=False)
     
+    def order_total(self, obj):
+        return obj.total_amount
+    order_total.short_description = 'Total'
+    order_total.admin_order_field = 'total_amount'
+    
     def payment_verified(self, obj):
         return obj.razorpay_payment_id is not None
     payment_verified.boolean = True
@@ -110,6 +127,7 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product', 'quantity', 'get_total', 'date_added']
     list_filter = ['date_added']
     readonly_fields = ['get_total', 'date_added']
+    list_select_related = ['order', 'product']
     list_per_page = 30
 
 @admin.register(ShippingAddress)
@@ -117,6 +135,23 @@ class ShippingAddressAdmin(admin.ModelAdmin):
     list_display = ['customer', 'address', 'city', 'state', 'zipcode', 'date_added']
     list_filter = ['state', 'city']
     search_fields = ['address', 'city', 'state', 'zipcode']
+    list_select_related = ['customer']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_at', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['created_at', 'finished_at', 'last_error']
+    list_per_page = 50
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'product', 'category', 'units', 'revenue']
+    list_filter = ['category']
+    search_fields = ['product__name', 'category']
+    date_hierarchy = 'date'
+    list_select_related = ['product']
+    list_per_page = 50
 
 # Import extended admin configurations
 try:
@@ -1,6 +1,10 @@
 """API views for enhanced features"""
+import hashlib
+from django.conf import settings
 from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET, require_POST, require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 import json
@@ -114,3 +118,84 @@ def subscribe_newsletter(request):
             return JsonResponse({'success': True, 'message': 'Already subscribed'})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_GET
+def search_suggest(request):
+    """Typeahead suggestions for the store search box"""
+    from .search import suggest
+
+    prefix = request.GET.get('q', '').strip()[:50]
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+
+    response = JsonResponse({'query': prefix, 'suggestions': suggest(prefix, limit=limit)})
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    response['ETag'] = etag
+    patch_cache_control(response, public=True,
+                        max_age=getattr(settings, 'SEARCH_SUGGEST_MAX_AGE', 300))
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+@require_GET
+def product_list(request):
+    """Product listing with keyset (cursor) pagination"""
+    from .models import Product
+    from .pagination import KEYSET_ORDERINGS, keyset_page
+
+    sort = request.GET.get('sort', '-created_at')
+    if sort not in KEYSET_ORDERINGS:
+        sort = '-created_at'
+    try:
+        per_page = min(max(int(request.GET.get('limit', 12)), 1), 50)
+    except ValueError:
+        per_page = 12
+
+    products = Product.objects.only('id', 'name', 'price', 'category', 'stock', 'image', 'views', 'created_at')
+    category = request.GET.get('category')
+    if category:
+        products = products.filter(category=category)
+
+    page = keyset_page(products, sort, per_page, request.GET.get('cursor'))
+    return JsonResponse({
+        'products': [{
+            'id': product.id,
+            'name': product.name,
+            'price': product.price,
+            'category': product.category,
+            'in_stock': product.in_stock,
+            'image': product.imageURL,
+        } for product in page],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    })
+
+
+def apply_cart_changes(request, changes):
+    """Apply cart line changes for the logged-in user and answer with the new cart"""
+    from django.core.exceptions import ValidationError
+    from .cart import apply_changes, cart_summary
+    from .models import Product
+
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'User not authenticated'}, status=401)
+    try:
+        order = apply_changes(request.user, changes)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    except Product.DoesNotExist as e:
+        return JsonResponse({'error': str(e) or 'Product not found'}, status=404)
+    return JsonResponse({'success': True, **cart_summary(order)})
+
+
+@require_http_methods(['PATCH'])
+def update_cart(request):
+    """Apply a list of {productId, quantity} (or {productId, delta}) changes"""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    changes = data.get('changes') if isinstance(data, dict) else data
+    return apply_cart_changes(request, changes)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.store'
+
+    def ready(self):
+        # Connect catalog cache and search index signal handlers and
+        # register background job handlers
+        from . import cache, search, tasks  # noqa: F401
@@ -1,34 +1,191 @@
 """Caching utilities for store app"""
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter
 from django.core.cache import cache
 from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 CACHE_TTL = getattr(settings, 'CACHE_TTL', 60 * 15)  # 15 minutes
 
+CATALOG_VERSION_KEY = 'catalog_version'
+
+# Cart badge counts are only invalidated in the worker that handled the
+# write, so with a per-process cache other workers may show a stale count
+# for up to this long
+CART_COUNT_TTL = getattr(settings, 'CART_COUNT_TTL', 30)
+
+# How long an expired entry may still be served while one caller refreshes it
+STALE_TTL = getattr(settings, 'CACHE_STALE_TTL', 60)
+
+# How long a recompute may hold the cross-process lock
+LOCK_TIMEOUT = 30
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+def cache_stats():
+    """Read-through cache counters: hits, misses, stale, early_refresh, coalesced, lock_wait"""
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+def _store(key, compute, ttl):
+    start = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - start
+    entry = {'value': value, 'expires': time.time() + ttl, 'delta': delta}
+    cache.set(key, entry, ttl + STALE_TTL)
+    return value
+
+def _refresh(key, compute, ttl):
+    """Recompute if no other process holds the refresh lock; returns (done, value)"""
+    lock_key = f'lock:{key}'
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        return False, None
+    try:
+        return True, _store(key, compute, ttl)
+    finally:
+        cache.delete(lock_key)
+
+def cached_call(key, compute, ttl=CACHE_TTL, beta=1.0):
+    """Read-through cache with stampede protection.
+
+    - Concurrent misses in one process are coalesced onto a single compute,
+      and a lock in the cache keeps other processes from recomputing too.
+    - Entries are refreshed early with a probability that grows as expiry
+      approaches, scaled by how long the value took to compute (``beta``).
+    - Expired entries are served for up to CACHE_STALE_TTL seconds while a
+      single caller recomputes them.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        remaining = entry['expires'] - time.time()
+        if remaining > 0:
+            # XFetch: -delta * beta * log(rand) is an exponentially distributed head start
+            if remaining > -entry['delta'] * beta * math.log(random.random() or 1e-12):
+                _count('hits')
+                return entry['value']
+            _count('early_refresh')
+        else:
+            _count('stale')
+        done, value = _refresh(key, compute, ttl)
+        return value if done else entry['value']
+
+    _count('misses')
+    with _inflight_lock:
+        flight = _inflight.setdefault(key, threading.Lock())
+    if not flight.acquire(blocking=False):
+        # Another thread is computing this key; wait for its result
+        _count('coalesced')
+        with flight:
+            pass
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+        flight.acquire()
+    try:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            done, value = _refresh(key, compute, ttl)
+            if done:
+                return value
+            # Another process is computing it; poll briefly before giving up
+            _count('lock_wait')
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry['value']
+            if time.monotonic() > deadline:
+                return _store(key, compute, ttl)
+    finally:
+        flight.release()
+        with _inflight_lock:
+            if _inflight.get(key) is flight:
+                del _inflight[key]
+
+def catalog_version():
+    """Current catalog generation; every catalog cache key embeds it"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+def bump_catalog_version():
+    """Invalidate every catalog cache entry at once by moving to a new generation"""
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 2, None)
+        return cache.get(CATALOG_VERSION_KEY, 2)
+
+def catalog_key(prefix, *parts):
+    """Bounded-length cache key for catalog data in the current generation"""
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return f'{prefix}:v{catalog_version()}:{digest}'
+
 def get_cached_products(category=None, query=None):
     """Get cached product list"""
-    cache_key = f'products_{category}_{query}'
-    products = cache.get(cache_key)
-    if products is None:
+    def load():
         from .models import Product
         products = Product.objects.all()
         if category:
             products = products.filter(category=category)
         if query:
             products = products.filter(name__icontains=query)
-        products = list(products.values())
-        cache.set(cache_key, products, CACHE_TTL)
-    return products
+        return list(products.values())
+    return cached_call(catalog_key('products', category, query), load)
+
+def get_cached_product(product_id):
+    """Product and up to four related products, or None if it does not exist"""
+    def load():
+        from .models import Product
+        product = Product.objects.filter(id=product_id).first()
+        if product is None:
+            return None
+        related = list(Product.objects.filter(category=product.category).exclude(id=product.id)[:4])
+        return (product, related)
+    return cached_call(catalog_key('product_detail', product_id), load)
 
 def invalidate_product_cache():
     """Clear product cache when products change"""
-    cache.delete_pattern('products_*')
+    bump_catalog_version()
 
 def get_cart_count(user_id):
-    """Get cached cart count"""
+    """Get cached cart count, or None on a cache miss"""
     cache_key = f'cart_count_{user_id}'
-    return cache.get(cache_key, 0)
+    return cache.get(cache_key)
 
 def set_cart_count(user_id, count):
     """Set cached cart count"""
     cache_key = f'cart_count_{user_id}'
-    cache.set(cache_key, count, CACHE_TTL)
+    cache.set(cache_key, count, CART_COUNT_TTL)
+
+def invalidate_cart_count(user_id):
+    """Drop cached cart count after the cart changes"""
+    cache.delete(f'cart_count_{user_id}')
+
+@receiver(post_save, sender='store.Product')
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    # View counts alone do not change what listings show
+    if update_fields and set(update_fields) <= {'views'}:
+        return
+    invalidate_product_cache()
+
+@receiver(post_delete, sender='store.Product')
+def product_deleted(sender, instance, **kwargs):
+    invalidate_product_cache()
@@ -0,0 +1,216 @@
+"""Cart services shared by views and context processors"""
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.db.models import Case, F, Q, Value, When
+from .cache import get_cart_count, set_cart_count, invalidate_cart_count
+from .models import Customer, Order, OrderItem, Product
+from .utils import parse_cart_cookie
+
+# Upper bound on line changes accepted in one bulk cart update
+MAX_CART_CHANGES = 100
+
+
+def cart_item_count(user):
+    """Badge count for an authenticated user's open cart.
+
+    Served from the cache when possible; a miss costs a single query against
+    the stored Order.item_count.
+    """
+    count = get_cart_count(user.id)
+    if count is None:
+        count = Order.objects.filter(
+            customer__user_id=user.id, complete=False
+        ).values_list('item_count', flat=True).first() or 0
+        set_cart_count(user.id, count)
+    return count
+
+
+def invalidate_cart(user_id):
+    """Invalidate cached cart state once the current transaction commits"""
+    if user_id:
+        transaction.on_commit(lambda: invalidate_cart_count(user_id))
+
+
+def open_order(user):
+    """The user's open order, creating the customer and order on first use"""
+    customer, _ = Customer.objects.get_or_create(
+        user=user,
+        defaults={'name': user.username, 'email': user.email}
+    )
+    order, _ = Order.objects.get_or_create(customer=customer, complete=False)
+    order.customer = customer
+    return order
+
+
+def parse_changes(changes):
+    """Validate a list of ``{productId, quantity}`` or ``{productId, delta}``.
+
+    Returns ``{product_id: (kind, value)}`` with kind ``'set'`` or ``'add'``;
+    raises ValidationError on malformed input.
+    """
+    if not isinstance(changes, list) or not changes:
+        raise ValidationError("Expected a non-empty list of changes")
+    if len(changes) > MAX_CART_CHANGES:
+        raise ValidationError(f"At most {MAX_CART_CHANGES} changes per request")
+
+    parsed = {}
+    for change in changes:
+        try:
+            product_id = int(change['productId'])
+            if 'quantity' in change:
+                kind, value = 'set', int(change['quantity'])
+            else:
+                kind, value = 'add', int(change['delta'])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError("Each change needs a productId and a quantity or delta")
+        if kind == 'set' and value < 0:
+            raise ValidationError("Quantity cannot be negative")
+        if product_id in parsed:
+            raise ValidationError(f"Product {product_id} appears more than once")
+        parsed[product_id] = (kind, value)
+    return parsed
+
+
+def _save_lines(to_create, to_update):
+    """Upsert new cart lines and write changed quantities, one statement each"""
+    if to_create:
+        # Only absolute quantities come through here, so a line created
+        # concurrently since it was read is overwritten with the new value.
+        # MySQL upserts on any unique key and takes no target fields.
+        supports_target = connections[OrderItem.objects.db].features.supports_update_conflicts_with_target
+        OrderItem.objects.bulk_create(
+            to_create, batch_size=500, update_conflicts=True, update_fields=['quantity'],
+            unique_fields=['order', 'product'] if supports_target else None,
+        )
+    if to_update:
+        OrderItem.objects.bulk_update(to_update, ['quantity'], batch_size=500)
+
+
+def _add_to_new_lines(order, increments):
+    """Add ``{product_id: delta}`` to lines that did not exist when read.
+
+    The lines are inserted empty, ignoring any a concurrent request created
+    meanwhile, and then all incremented in one UPDATE. Two simultaneous adds
+    of a new product therefore sum up instead of overwriting each other.
+    """
+    OrderItem.objects.bulk_create(
+        [OrderItem(order=order, product_id=product_id, quantity=0) for product_id in increments],
+        batch_size=500, ignore_conflicts=True,
+    )
+    OrderItem.objects.filter(order=order, product_id__in=increments).update(
+        quantity=F('quantity') + Case(
+            *[When(product_id=product_id, then=Value(delta)) for product_id, delta in increments.items()],
+            default=Value(0),
+        )
+    )
+
+
+def apply_changes(user, changes):
+    """Apply many cart line changes for a user as one unit.
+
+    Stock for every product is read with a single ``id__in`` query and only
+    checked for lines that grow; it is enforced again at checkout, and no
+    product row is locked. New lines with an absolute quantity are upserted
+    with one ``bulk_create``, new lines with a delta are inserted and then
+    incremented, changed lines written with one ``bulk_update`` (relative
+    changes as ``F()`` increments) and emptied lines deleted. Returns the
+    open order with fresh totals.
+    """
+    parsed = parse_changes(changes)
+    stock = dict(Product.objects.filter(id__in=parsed).values_list('id', 'stock'))
+    missing = sorted(set(parsed) - set(stock))
+    if missing:
+        raise Product.DoesNotExist(f"Product not found: {', '.join(map(str, missing))}")
+
+    with transaction.atomic():
+        order = open_order(user)
+        lines = {line.product_id: line for line in OrderItem.objects.filter(order=order, product_id__in=parsed)}
+
+        to_create, to_update, to_delete, short = [], [], [], []
+        increments = {}
+        for product_id, (kind, value) in parsed.items():
+            line = lines.get(product_id)
+            current = (line.quantity or 0) if line else 0
+            target = value if kind == 'set' else current + value
+            if target > current and target > stock[product_id]:
+                short.append(f"Insufficient stock for product {product_id}. Only {stock[product_id]} available.")
+            elif target <= 0:
+                if line:
+                    to_delete.append(line.id)
+            elif line is None and kind == 'add':
+                increments[product_id] = value
+            elif line is None:
+                to_create.append(OrderItem(order=order, product_id=product_id, quantity=target))
+            elif target != current:
+                # Relative changes stay increments so concurrent clicks add up
+                line.quantity = target if kind == 'set' else F('quantity') + value
+                to_update.append(line)
+        if short:
+            raise ValidationError(short)
+
+        _save_lines(to_create, to_update)
+        if increments:
+            _add_to_new_lines(order, increments)
+        if to_delete or any(kind == 'add' and value < 0 for kind, value in parsed.values()):
+            OrderItem.objects.filter(order=order).filter(
+                Q(id__in=to_delete) | Q(product_id__in=parsed, quantity__lte=0)
+            ).delete()
+
+        # Bulk writes skip the OrderItem signals
+        Order.recalculate_totals([order.id])
+        invalidate_cart(user.id)
+
+    order.refresh_from_db(fields=Order.TOTAL_FIELDS)
+    return order
+
+
+def cart_summary(order):
+    """JSON-ready lines and totals of an open order"""
+    return {
+        'items': [
+            {'productId': product_id, 'quantity': quantity}
+            for product_id, quantity in order.orderitem_set.filter(
+                product__isnull=False
+            ).order_by('id').values_list('product_id', 'quantity')
+        ],
+        'cartItems': order.item_count,
+        'cartTotal': order.total_amount,
+        'shipping': order.requires_shipping,
+    }
+
+
+def merge_cookie_cart(request, user):
+    """Fold the anonymous cart cookie into the user's open order on login.
+
+    Each line ends up with the larger of the cookie and stored quantities,
+    capped at stock, so merging the same cookie twice changes nothing.
+    Returns the number of cookie lines merged; the caller clears the cookie.
+    """
+    lines, _ = parse_cart_cookie(request.COOKIES.get('cart'))
+    if not lines:
+        return 0
+    stock = dict(Product.objects.filter(id__in=lines).values_list('id', 'stock'))
+    if not stock:
+        return 0
+
+    with transaction.atomic():
+        order = open_order(user)
+        existing = {line.product_id: line for line in OrderItem.objects.filter(order=order, product_id__in=stock)}
+        to_create, to_update = [], []
+        for product_id, available in stock.items():
+            line = existing.get(product_id)
+            current = (line.quantity or 0) if line else 0
+            target = min(lines[product_id], available)
+            if target <= current:
+                continue
+            if line is None:
+                to_create.append(OrderItem(order=order, product_id=product_id, quantity=target))
+            else:
+                line.quantity = target
+                to_update.append(line)
+
+        if to_create or to_update:
+            _save_lines(to_create, to_update)
+            Order.recalculate_totals([order.id])
+            invalidate_cart(user.id)
+    return len(stock)
@@ -1,5 +1,5 @@
 from .utils import cookieCart
-from .models import Order, Customer
+from .cart import cart_item_count
 
 def cart_context(request):
     """Add cart items count to all templates"""
@@ -7,16 +7,7 @@ def cart_context(request):
     
     try:
         if request.user.is_authenticated:
-            try:
-                customer = request.user.customer
-            except Customer.DoesNotExist:
-                customer, created = Customer.objects.get_or_create(
-                    user=request.user,
-                    defaults={'name': request.user.username, 'email': request.user.email}
-                )
-            order = Order.objects.filter(customer=customer, complete=False).first()
-            if order:
-                cartItems = order.get_cart_items
+            cartItems = cart_item_count(request.user)
         else:
             cookieData = cookieCart(request)
             cartItems = cookieData['cartItems']
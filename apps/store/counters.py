@@ -0,0 +1,116 @@
+"""Buffered counters that are flushed to the database in batches"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCountBuffer:
+    """Accumulate product views in memory and write them in batches.
+
+    Each process keeps its own buffer. Once ``start()`` has been called, as
+    the WSGI entry point does, requests only record and a daemon thread
+    flushes every PRODUCT_VIEW_FLUSH_INTERVAL seconds, or as soon as
+    PRODUCT_VIEW_BUFFER_SIZE products are pending. Processes that never
+    start it, like management commands and tests, flush inline when either
+    limit is reached. The buffer is always flushed at interpreter exit, and
+    views recorded since the last flush are lost if the process is killed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._last_flush = time.monotonic()
+        self._wake = threading.Event()
+        self._background = False
+        self._thread = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'PRODUCT_VIEW_FLUSH_INTERVAL', 60)
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'PRODUCT_VIEW_BUFFER_SIZE', 500)
+
+    def start(self):
+        """Hand flushing to a background thread from now on"""
+        self._background = True
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each preforked worker starts its own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='product-view-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                # Don't hold this thread's database connection between flushes
+                connections.close_all()
+
+    def record(self, product_id, count=1):
+        with self._lock:
+            self._pending[product_id] += count
+            full = len(self._pending) >= self.max_size
+            due = full or time.monotonic() - self._last_flush >= self.flush_interval
+        if self._background:
+            self._ensure_thread()
+            if full:
+                self._wake.set()
+        elif due:
+            self.flush()
+
+    def flush(self):
+        """Write buffered views with one F() update per distinct increment"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        # Products that received the same number of views share a statement
+        by_increment = defaultdict(list)
+        for product_id, count in pending.items():
+            by_increment[count].append(product_id)
+
+        from .models import Product
+        try:
+            with transaction.atomic():
+                for count, product_ids in by_increment.items():
+                    Product.objects.filter(id__in=product_ids).update(views=F('views') + count)
+        except Exception as e:
+            # Put the views back so the next flush retries them
+            with self._lock:
+                self._pending.update(pending)
+            logger.error(f"Failed to flush product views: {str(e)}")
+            return 0
+        return len(pending)
+
+
+view_counts = ViewCountBuffer()
+
+
+def record_product_view(product_id):
+    view_counts.record(product_id)
+
+
+def flush_product_views():
+    return view_counts.flush()
+
+
+atexit.register(flush_product_views)
@@ -0,0 +1,38 @@
+"""Facet counts for the store listing"""
+from django.db.models import Count
+from .cache import cached_call, catalog_key
+
+
+def facet_rows(products):
+    """Per-category product counts in one grouped query"""
+    return list(products.order_by().values('category').annotate(total=Count('id')))
+
+
+def cached_facet_rows(product_ids=None):
+    """Facet rows for the catalog, or for a set of search matches.
+
+    Cached per catalog generation, so any product write invalidates them.
+    """
+    def load():
+        from .models import Product
+        products = Product.objects.all()
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+        return facet_rows(products)
+    return cached_call(catalog_key('facets', product_ids), load)
+
+
+def summarize(rows, category=None):
+    """Fold facet rows into the counts shown on the store page.
+
+    Category counts ignore the selected category so shoppers can switch
+    between them; the total applies to the selected category only.
+    """
+    selected = [row for row in rows if row['category'] == category] if category else rows
+    return {
+        'categories': sorted(
+            ((row['category'], row['total']) for row in rows if row['category']),
+            key=lambda item: item[0],
+        ),
+        'total': sum(row['total'] for row in selected),
+    }
@@ -0,0 +1,162 @@
+"""Stock accounting: checkout reservations and decrements for completed orders"""
+import datetime
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .cache import cached_call, invalidate_product_cache
+from .models import OrderItem, Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+HOLDS_CACHE_KEY = 'stock_holds'
+
+# Active holds change as they expire, so the cached totals are short-lived
+HOLDS_CACHE_TTL = 30
+
+
+class InsufficientStock(ValidationError):
+    """Raised when a product cannot cover the requested quantity"""
+
+    def __init__(self, product_id, name=None):
+        self.product_id = product_id
+        super().__init__(f"Insufficient stock for {name or f'product {product_id}'}")
+
+
+def order_quantities(order):
+    """{product_id: quantity} of an order's lines, in one query"""
+    return dict(
+        OrderItem.objects.filter(order=order, product__isnull=False)
+        .values_list('product_id')
+        .annotate(quantity=Sum('quantity'))
+    )
+
+
+def reservation_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60)
+
+
+def active_holds(order=None):
+    """Unexpired reservations, optionally excluding one order's own"""
+    holds = StockReservation.objects.filter(expires_at__gt=timezone.now())
+    if order is not None:
+        holds = holds.exclude(order=order)
+    return holds
+
+
+def held_quantities():
+    """{product_id: units held by active reservations}, served from the cache"""
+    return cached_call(HOLDS_CACHE_KEY, lambda: dict(
+        active_holds().values_list('product_id').annotate(total=Sum('quantity'))
+    ), ttl=HOLDS_CACHE_TTL)
+
+
+def apply_holds(products):
+    """Set ``held`` on product instances so ``available`` excludes reserved units"""
+    holds = held_quantities()
+    if holds:
+        for product in products:
+            product.held = holds.get(product.id, 0)
+    return products
+
+
+def _holds_changed():
+    transaction.on_commit(lambda: cache.delete(HOLDS_CACHE_KEY))
+
+
+def reserve(order):
+    """Hold every line of an order until payment or expiry.
+
+    Replaces any holds the order already has. Product rows are locked in id
+    order for the duration of the check so two checkouts cannot both claim
+    the last units; available stock is ``stock`` minus other orders' active
+    holds. Raises InsufficientStock, leaving no holds, if any line is short.
+    """
+    quantities = order_quantities(order)
+    with transaction.atomic():
+        StockReservation.objects.filter(order=order).delete()
+        if quantities:
+            stock = dict(
+                Product.objects.select_for_update().filter(id__in=quantities)
+                .order_by('id').values_list('id', 'stock')
+            )
+            held = dict(
+                active_holds(order).filter(product_id__in=quantities)
+                .values_list('product_id').annotate(total=Sum('quantity'))
+            )
+            for product_id in sorted(quantities):
+                if stock.get(product_id, 0) - held.get(product_id, 0) < quantities[product_id]:
+                    name = Product.objects.filter(pk=product_id).values_list('name', flat=True).first()
+                    raise InsufficientStock(product_id, name)
+
+            expires_at = timezone.now() + datetime.timedelta(seconds=reservation_ttl())
+            StockReservation.objects.bulk_create([
+                StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+        _holds_changed()
+
+
+def release(order):
+    """Drop the holds of an order (instance or id), e.g. when its payment is cancelled"""
+    deleted, _ = StockReservation.objects.filter(order=order).delete()
+    if deleted:
+        _holds_changed()
+    return deleted
+
+
+def release_expired(batch_size=1000):
+    """Delete expired holds in batches; returns how many were removed"""
+    now = timezone.now()
+    total = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(expires_at__lte=now)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        total += StockReservation.objects.filter(id__in=ids).delete()[0]
+    if total:
+        cache.delete(HOLDS_CACHE_KEY)
+    return total
+
+
+def decrement_stock(quantities, order=None):
+    """Take ``{product_id: quantity}`` out of stock, all or nothing.
+
+    Each product costs one ``UPDATE ... SET stock = stock - q WHERE stock >= q + h``,
+    where ``h`` is what other orders' active reservations hold, issued in id
+    order so concurrent checkouts lock rows consistently. If any product is
+    short, every decrement made here is rolled back and InsufficientStock is
+    raised. On success the holds of ``order`` are converted, i.e. dropped.
+    Queryset updates skip the Product signals, so the catalog cache is
+    invalidated once the transaction commits.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+
+    held_by_others = Coalesce(Subquery(
+        active_holds(order).filter(product=OuterRef('pk'))
+        .values('product').annotate(total=Sum('quantity')).values('total')
+    ), 0)
+
+    with transaction.atomic():
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+            updated = Product.objects.filter(pk=product_id, stock__gte=held_by_others + quantity).update(
+                stock=F('stock') - quantity
+            )
+            if not updated:
+                name = Product.objects.filter(pk=product_id).values_list('name', flat=True).first()
+                logger.warning(f"Stock decrement of {quantity} failed for product {product_id}")
+                raise InsufficientStock(product_id, name)
+        if order is not None:
+            release(order)
+
+    transaction.on_commit(invalidate_product_cache)
@@ -0,0 +1,94 @@
+"""Invoice PDFs, rendered once per order and cached on disk"""
+import hashlib
+import logging
+import os
+import tempfile
+from io import BytesIO
+from django.conf import settings
+from django.db.models import Prefetch
+from django.template.loader import get_template
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+INVOICE_TEMPLATE = 'store/invoice_pdf.html'
+
+# Directory under MEDIA_ROOT holding the cached PDFs
+INVOICE_DIR = 'invoices'
+
+
+class InvoiceError(Exception):
+    pass
+
+
+def invoice_orders():
+    """Completed orders with everything the invoice template reads prefetched"""
+    return Order.objects.filter(complete=True).select_related('customer').prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product').order_by('id')),
+        'shippingaddress_set',
+    )
+
+
+def render_html(order):
+    addresses = list(order.shippingaddress_set.all())
+    return get_template(INVOICE_TEMPLATE).render({
+        'order': order,
+        'items': order.orderitem_set.all(),
+        'shipping_address': addresses[0] if addresses else None,
+    })
+
+
+def render_pdf(html):
+    from xhtml2pdf import pisa
+    buffer = BytesIO()
+    if pisa.CreatePDF(html, dest=buffer).err:
+        raise InvoiceError("PDF rendering failed")
+    return buffer.getvalue()
+
+
+def invoice_path(digest):
+    """Absolute path of the PDF whose source HTML hashes to ``digest``"""
+    return os.path.join(settings.MEDIA_ROOT, INVOICE_DIR, digest[:2], f'{digest}.pdf')
+
+
+def ensure_invoice(order):
+    """Render the order's invoice unless an identical one is already on disk.
+
+    Files are addressed by the SHA-256 of the rendered HTML, so the PDF step
+    only runs when the order or the template changed. Returns the digest.
+    """
+    html = render_html(order)
+    digest = hashlib.sha256(html.encode('utf-8')).hexdigest()
+    path = invoice_path(digest)
+
+    if not os.path.exists(path):
+        pdf = render_pdf(html)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(pdf)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    if order.invoice_digest != digest:
+        if order.invoice_digest:
+            try:
+                os.remove(invoice_path(order.invoice_digest))
+            except FileNotFoundError:
+                pass
+        Order.objects.filter(pk=order.pk).update(invoice_digest=digest)
+        order.invoice_digest = digest
+    return digest
+
+
+def cached_invoice(order):
+    """(digest, path) of the order's invoice, rendering it if it is missing"""
+    digest = order.invoice_digest
+    if not digest or not os.path.exists(invoice_path(digest)):
+        order = invoice_orders().get(pk=order.pk)
+        digest = ensure_invoice(order)
+    return digest, invoice_path(digest)
@@ -0,0 +1,118 @@
+"""Database-backed background job queue.
+
+Handlers are registered with ``@job('name')`` and queued with
+``enqueue('name', **payload)``; the row is written once the surrounding
+transaction commits, so a rolled-back request never leaves work behind.
+``manage.py run_jobs`` claims due jobs with a conditional UPDATE, so any
+number of workers can share the table, and failed jobs are retried with
+exponential backoff until ``max_attempts`` is reached.
+"""
+import datetime
+import logging
+import random
+import traceback
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def job(name):
+    """Register a function as the handler for jobs called ``name``"""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def max_attempts():
+    return getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+
+
+def retry_delay(attempts):
+    """Seconds before the next try: doubling from JOB_RETRY_BACKOFF, capped, with jitter"""
+    base = getattr(settings, 'JOB_RETRY_BACKOFF', 30)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'JOB_RETRY_MAX_DELAY', 3600))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def lease_seconds():
+    """How long a claimed job is reserved before another worker may retry it"""
+    return getattr(settings, 'JOB_LEASE_SECONDS', 300)
+
+
+def enqueue(name, delay=0, **payload):
+    """Queue ``name`` to run with ``payload`` after the current transaction commits"""
+    if name not in _handlers:
+        raise ValueError(f"Unknown job: {name}")
+
+    def create():
+        Job.objects.create(
+            name=name,
+            payload=payload,
+            max_attempts=max_attempts(),
+            run_at=timezone.now() + datetime.timedelta(seconds=delay),
+        )
+    transaction.on_commit(create)
+
+
+def due_jobs(now=None):
+    """Pending jobs that are due, plus running jobs whose worker lease lapsed"""
+    now = now or timezone.now()
+    return Job.objects.filter(
+        Q(status='pending', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+    )
+
+
+def claim(job_id, now=None):
+    """Take a due job for this worker; False if another worker got it first"""
+    now = now or timezone.now()
+    return bool(due_jobs(now).filter(pk=job_id).update(
+        status='running',
+        attempts=F('attempts') + 1,
+        locked_until=now + datetime.timedelta(seconds=lease_seconds()),
+    ))
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome"""
+    handler = _handlers.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job {job.name}")
+        handler(**job.payload)
+    except Exception as e:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+            logger.error(f"Job {job.name} #{job.id} failed permanently: {str(e)}")
+        else:
+            job.status = 'pending'
+            job.run_at = timezone.now() + datetime.timedelta(seconds=retry_delay(job.attempts))
+            logger.warning(f"Job {job.name} #{job.id} failed (attempt {job.attempts}), retrying: {str(e)}")
+        job.locked_until = None
+        job.save(update_fields=['status', 'run_at', 'locked_until', 'last_error', 'finished_at'])
+        return False
+
+    job.status = 'done'
+    job.locked_until = None
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'locked_until', 'finished_at'])
+    return True
+
+
+def run_pending(limit=100):
+    """Claim and run up to ``limit`` due jobs; returns how many were run"""
+    ran = 0
+    for job_id in due_jobs().order_by('run_at', 'id').values_list('id', flat=True)[:limit]:
+        if not claim(job_id):
+            continue
+        run_job(Job.objects.get(pk=job_id))
+        ran += 1
+    return ran
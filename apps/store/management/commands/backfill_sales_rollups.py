@@ -0,0 +1,35 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from apps.store.models import Order
+from apps.store.reports import date_chunks, rebuild, sale_date
+
+class Command(BaseCommand):
+    help = 'Rebuild daily sales rollups from completed orders, a chunk of days at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=datetime.date.fromisoformat, help='First day (YYYY-MM-DD); defaults to the first order')
+        parser.add_argument('--end', type=datetime.date.fromisoformat, help='Last day (YYYY-MM-DD); defaults to today')
+        parser.add_argument('--chunk-days', type=int, default=7)
+
+    def handle(self, *args, **options):
+        start = options['start']
+        if start is None:
+            first = Order.objects.filter(complete=True, completed_at__isnull=False).order_by('completed_at').first()
+            if first is None:
+                self.stdout.write(self.style.SUCCESS('Successfully rebuilt 0 rollup rows'))
+                return
+            start = sale_date(first)
+        end = (options['end'] or timezone.localdate()) + datetime.timedelta(days=1)
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days must be at least 1')
+
+        total = 0
+        for chunk_start, chunk_end in date_chunks(start, end, options['chunk_days']):
+            written = rebuild(chunk_start, chunk_end)
+            total += written
+            self.stdout.write(f"{chunk_start} to {chunk_end - datetime.timedelta(days=1)}: {written} rows")
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {total} rollup rows')
+        )
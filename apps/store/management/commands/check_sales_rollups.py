@@ -0,0 +1,37 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from apps.store.reports import date_chunks, find_mismatches, rebuild
+
+class Command(BaseCommand):
+    help = 'Compare daily sales rollups with completed orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='How many days back to check, today included')
+        parser.add_argument('--chunk-days', type=int, default=7)
+        parser.add_argument('--fix', action='store_true', help='Rebuild the days that disagree')
+
+    def handle(self, *args, **options):
+        end = timezone.localdate() + datetime.timedelta(days=1)
+        start = end - datetime.timedelta(days=options['days'])
+
+        mismatches = []
+        for chunk_start, chunk_end in date_chunks(start, end, options['chunk_days']):
+            mismatches += find_mismatches(chunk_start, chunk_end)
+
+        for day, product_id, expected, actual in mismatches:
+            self.stdout.write(
+                f"{day} product {product_id}: orders have {expected[0]} units / {expected[1]}, "
+                f"rollup has {actual[0]} units / {actual[1]}"
+            )
+
+        if mismatches and not options['fix']:
+            raise CommandError(f'{len(mismatches)} rollup rows disagree with orders; rerun with --fix to rebuild them')
+
+        days = sorted({day for day, _, _, _ in mismatches})
+        for day in days:
+            rebuild(day, day + datetime.timedelta(days=1))
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully checked {options["days"]} days, rebuilt {len(days)}')
+        )
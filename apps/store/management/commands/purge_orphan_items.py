@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.store.tasks import purge_orphan_items
+
+class Command(BaseCommand):
+    help = 'Delete open-cart items whose product no longer exists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        purged = purge_orphan_items(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully purged {purged} orphaned order items')
+        )
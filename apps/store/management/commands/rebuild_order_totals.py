@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from apps.store.models import Order
+
+class Command(BaseCommand):
+    help = 'Rebuild stored order totals (total_amount, item_count, requires_shipping)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--incomplete-only', action='store_true',
+                            help='Only rebuild open carts')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Completed orders keep the totals they were paid at; only those with
+        # no stored totals yet (e.g. from before the columns existed) are filled
+        orders = Order.objects.order_by('pk')
+        if options['incomplete_only']:
+            orders = orders.filter(complete=False)
+        else:
+            orders = orders.filter(~Q(complete=True) | Q(item_count=0))
+
+        total_updated = 0
+        last_pk = 0
+
+        while True:
+            # Walk the primary key range so each batch is an index range scan
+            batch = list(orders.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            total_updated += Order.recalculate_totals(batch, include_completed=True)
+            last_pk = batch[-1]
+            self.stdout.write(f"Rebuilt totals for {total_updated} orders (last id {last_pk})")
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt totals for {total_updated} orders')
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.store.inventory import release_expired
+
+class Command(BaseCommand):
+    help = 'Release stock reservations whose checkout hold has expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully released {released} expired reservations')
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from apps.store.invoices import ensure_invoice, invoice_orders
+from apps.store.jobs import enqueue
+
+class Command(BaseCommand):
+    help = 'Re-render cached invoice PDFs, e.g. after changing the invoice template'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue one render_invoice job per order instead of rendering here')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        orders = invoice_orders().order_by('pk')
+
+        total = 0
+        changed = 0
+        last_pk = 0
+
+        while True:
+            # Walk the primary key range; each batch is one query plus prefetches
+            batch = list(orders.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for order in batch:
+                if options['enqueue']:
+                    enqueue('render_invoice', order_id=order.pk)
+                else:
+                    previous = order.invoice_digest
+                    if ensure_invoice(order) != previous:
+                        changed += 1
+            total += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f"Processed {total} orders (last id {last_pk})")
+
+        if options['enqueue']:
+            self.stdout.write(self.style.SUCCESS(f'Successfully queued {total} invoice renders'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully checked {total} invoices, {changed} re-rendered'))
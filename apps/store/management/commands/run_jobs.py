@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.store.jobs import run_pending
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (emails, invoices); loops until stopped unless --once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run the jobs that are due now, then exit')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        total_run = 0
+        while True:
+            close_old_connections()
+            ran = run_pending(limit=options['batch_size'])
+            total_run += ran
+            if ran:
+                self.stdout.write(f"Ran {ran} jobs ({total_run} total)")
+            if options['once'] and ran < options['batch_size']:
+                break
+            if not ran:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully ran {total_run} jobs')
+        )
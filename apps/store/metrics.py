@@ -0,0 +1,138 @@
+"""Admin dashboard metrics, computed in one pass and kept current incrementally.
+
+Daily revenue and units are read from the sales rollups in
+apps.store.reports.
+
+The snapshot is cached with ``cached_call``. Completed orders are folded
+into the cached copy as they happen, so the full recompute only runs when
+the entry is missing or its TTL runs out. Figures that no event tracks,
+like new products, customers and carts, are only as fresh as that TTL.
+"""
+import datetime
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, DateField, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .cache import LOCK_TIMEOUT, STALE_TTL, cached_call
+from .models import Customer, Order, Product
+from .reports import daily_sales, day_start, sale_date
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'dashboard_metrics'
+
+# Days covered by the daily revenue and order series, today included
+SERIES_DAYS = 30
+
+
+def metrics_ttl():
+    return getattr(settings, 'DASHBOARD_METRICS_TTL', 15 * 60)
+
+
+def series_start(today=None):
+    return (today or timezone.localdate()) - datetime.timedelta(days=SERIES_DAYS - 1)
+
+
+def compute_metrics():
+    """Dashboard totals plus daily series.
+
+    Order figures come from a single GROUP BY over Order. Rows older than the
+    series window share one bucket, and summing every bucket gives the
+    totals. Revenue is read from the stored ``total_amount``, so OrderItem
+    is never scanned. Per-day sales come from the rollups.
+    """
+    today = timezone.localdate()
+    start = series_start(today)
+    # Completed orders count on the day they were paid
+    day = Case(
+        When(completed_at__gte=day_start(start), then=TruncDate('completed_at')),
+        default=Value(None),
+        output_field=DateField(),
+    )
+    rows = Order.objects.order_by().values(day=day).annotate(
+        revenue=Sum('total_amount', filter=Q(complete=True)),
+        orders=Count('id', filter=Q(complete=True)),
+        pending=Count('id', filter=Q(complete=False)),
+    )
+
+    metrics = {
+        'total_revenue': 0,
+        'total_orders': 0,
+        'pending_orders': 0,
+        'total_customers': Customer.objects.count(),
+        'total_products': Product.objects.count(),
+        'series': [
+            {'date': start + datetime.timedelta(days=i), 'revenue': 0, 'units': 0, 'orders': 0}
+            for i in range(SERIES_DAYS)
+        ],
+    }
+    by_date = {point['date']: point for point in metrics['series']}
+    for row in rows:
+        metrics['total_revenue'] += row['revenue'] or 0
+        metrics['total_orders'] += row['orders']
+        metrics['pending_orders'] += row['pending']
+        point = by_date.get(row['day'])
+        if point is not None:
+            point['orders'] += row['orders']
+
+    end = today + datetime.timedelta(days=1)
+    for day, sales in daily_sales(start, end).items():
+        point = by_date.get(day)
+        if point is not None:
+            point.update(sales)
+    return metrics
+
+
+def dashboard_metrics():
+    """Cached dashboard snapshot, recomputed by a single caller on expiry"""
+    return cached_call(METRICS_KEY, compute_metrics, ttl=metrics_ttl())
+
+
+def _update_cached(change):
+    """Apply ``change`` to the cached snapshot, if there is one"""
+    lock_key = f'lock:{METRICS_KEY}'
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        # A recompute is running and may or may not include this change;
+        # dropping the entry means it is at worst one TTL behind
+        cache.delete(METRICS_KEY)
+        return
+    try:
+        entry = cache.get(METRICS_KEY)
+        if entry is None:
+            return
+        change(entry['value'])
+        remaining = max(entry['expires'] - time.time(), 0)
+        cache.set(METRICS_KEY, entry, remaining + STALE_TTL)
+    finally:
+        cache.delete(lock_key)
+
+
+def record_completed_order(order):
+    """Fold a newly completed order into the cached metrics after commit"""
+    revenue = order.total_amount or 0
+    units = order.item_count or 0
+    day = sale_date(order)
+
+    def change(metrics):
+        metrics['total_revenue'] += revenue
+        metrics['total_orders'] += 1
+        metrics['pending_orders'] = max(metrics['pending_orders'] - 1, 0)
+        for point in metrics['series']:
+            if point['date'] == day:
+                point['revenue'] += revenue
+                point['units'] += units
+                point['orders'] += 1
+                break
+
+    def apply():
+        try:
+            _update_cached(change)
+        except Exception as e:
+            logger.error(f"Failed to update dashboard metrics for order {order.id}: {str(e)}")
+            cache.delete(METRICS_KEY)
+
+    transaction.on_commit(apply)
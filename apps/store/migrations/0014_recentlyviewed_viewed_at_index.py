@@ -0,0 +1,23 @@
+# Generated by Django 4.2.2 on 2026-10-18 09:35
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_order_total_amount_item_count_requires_shipping'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recentlyviewed',
+            name='viewed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='recentlyviewed',
+            index=models.Index(fields=['user', '-viewed_at'], name='store_recen_user_id_f30697_idx'),
+        ),
+    ]
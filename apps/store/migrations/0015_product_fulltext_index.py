@@ -0,0 +1,78 @@
+# Full-text index used by apps.store.search.DatabaseFullTextBackend
+
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts USING fts5("
+    "name, description, category, content='store_product', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS store_product_fts_ai AFTER INSERT ON store_product BEGIN "
+    "INSERT INTO store_product_fts(rowid, name, description, category) "
+    "VALUES (new.id, new.name, new.description, new.category); END",
+    "CREATE TRIGGER IF NOT EXISTS store_product_fts_ad AFTER DELETE ON store_product BEGIN "
+    "INSERT INTO store_product_fts(store_product_fts, rowid, name, description, category) "
+    "VALUES ('delete', old.id, old.name, old.description, old.category); END",
+    "CREATE TRIGGER IF NOT EXISTS store_product_fts_au AFTER UPDATE OF name, description, category "
+    "ON store_product BEGIN "
+    "INSERT INTO store_product_fts(store_product_fts, rowid, name, description, category) "
+    "VALUES ('delete', old.id, old.name, old.description, old.category); "
+    "INSERT INTO store_product_fts(rowid, name, description, category) "
+    "VALUES (new.id, new.name, new.description, new.category); END",
+    "INSERT INTO store_product_fts(store_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS store_product_fts_ai",
+    "DROP TRIGGER IF EXISTS store_product_fts_ad",
+    "DROP TRIGGER IF EXISTS store_product_fts_au",
+    "DROP TABLE IF EXISTS store_product_fts",
+]
+
+MYSQL_FORWARD = [
+    "ALTER TABLE store_product ADD FULLTEXT INDEX store_product_fulltext (name, description, category)",
+]
+
+MYSQL_REVERSE = [
+    "ALTER TABLE store_product DROP INDEX store_product_fulltext",
+]
+
+
+def _sqlite_has_fts5(cursor):
+    cursor.execute("PRAGMA compile_options")
+    return any('FTS5' in row[0] for row in cursor.fetchall())
+
+
+def _run(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            if not _sqlite_has_fts5(cursor):
+                return
+        _run(schema_editor, SQLITE_FORWARD)
+    elif vendor == 'mysql':
+        _run(schema_editor, MYSQL_FORWARD)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE)
+    elif vendor == 'mysql':
+        _run(schema_editor, MYSQL_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_recentlyviewed_viewed_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
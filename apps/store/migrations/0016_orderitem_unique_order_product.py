@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold repeated order/product lines into the oldest one"""
+    OrderItem = apps.get_model('store', 'OrderItem')
+    duplicates = (
+        OrderItem.objects.filter(order__isnull=False, product__isnull=False)
+        .values('order_id', 'product_id')
+        .annotate(lines=Count('id'), keep=Min('id'), quantity=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates.iterator():
+        lines = OrderItem.objects.filter(order_id=row['order_id'], product_id=row['product_id'])
+        lines.filter(id=row['keep']).update(quantity=row['quantity'])
+        lines.exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_product_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product'),
+        ),
+    ]
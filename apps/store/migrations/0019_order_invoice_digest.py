@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-18 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='invoice_digest',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
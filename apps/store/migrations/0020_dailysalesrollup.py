@@ -0,0 +1,32 @@
+# Generated by Django 4.2.2 on 2026-10-18 10:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_order_invoice_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('category', models.CharField(blank=True, max_length=100, null=True)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_sales', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'date'], name='store_daily_categor_8786b2_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'product'), name='unique_daily_sales_per_product'),
+        ),
+    ]
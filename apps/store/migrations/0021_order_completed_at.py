@@ -0,0 +1,30 @@
+# Generated by Django 4.2.2 on 2026-10-18 10:27
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_completed_at(apps, schema_editor):
+    """Completed orders recorded no payment time; the order date is the best estimate"""
+    Order = apps.get_model('store', 'Order')
+    Order.objects.filter(complete=True, completed_at__isnull=True).update(completed_at=F('date_ordered'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_dailysalesrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['completed_at'], name='store_order_complet_0515ae_idx'),
+        ),
+        migrations.RunPython(backfill_completed_at, migrations.RunPython.noop),
+    ]
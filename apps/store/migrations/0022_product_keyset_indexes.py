@@ -0,0 +1,37 @@
+# Generated by Django 4.2.2 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_order_completed_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='store_produ_categor_395ed6_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='store_produ_views_be84b4_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='store_produ_categor_8e1981_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-created_at', '-id'], name='store_produ_created_68f480_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-views', '-id'], name='store_produ_views_a5ae33_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='store_produ_price_aba1d8_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.2 on 2026-10-18 10:56
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_unit_price(apps, schema_editor):
+    """Completed lines recorded no price; the current product price is the best estimate"""
+    OrderItem = apps.get_model('store', 'OrderItem')
+    Product = apps.get_model('store', 'Product')
+    price = Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]
+    OrderItem.objects.filter(
+        order__complete=True, product__isnull=False, unit_price__isnull=True
+    ).update(unit_price=Subquery(price))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_unit_price, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import Exists, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 import uuid
 
@@ -44,38 +46,48 @@ class Product(models.Model):
             
         return url
     
+    # Units held by other shoppers' reservations; set by inventory.apply_holds
+    held = 0
+
     @property
     def in_stock(self):
         return self.stock > 0
+
+    @property
+    def available(self):
+        """Stock not held by active reservations"""
+        return max(self.stock - self.held, 0)
     
     def reduce_stock(self, quantity):
         """Thread-safe stock reduction"""
-        if self.stock < quantity:
-            raise ValidationError(f"Insufficient stock for {self.name}")
-        self.stock -= quantity
-        self.save(update_fields=['stock'])
+        from .inventory import decrement_stock
+        decrement_stock({self.pk: quantity})
+        self.refresh_from_db(fields=['stock'])
     
     def increment_views(self):
-        """Increment product views - safe for existing products"""
-        if hasattr(self, 'views') and self.views is not None:
-            self.views += 1
-        else:
-            self.views = 1
-        self.save(update_fields=['views'])
+        """Record a product view; the buffered count is flushed in batches"""
+        from .counters import record_product_view
+        record_product_view(self.pk)
 
     def __str__(self):
         return self.name
     
     class Meta:
+        # One index per keyset sort, ending in the id tiebreaker, so a page is
+        # a range read in index order (see pagination.KEYSET_ORDERINGS)
         indexes = [
-            models.Index(fields=['category', '-created_at']),
-            models.Index(fields=['-views']),
+            models.Index(fields=['category', '-created_at', '-id']),
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['-views', '-id']),
+            models.Index(fields=['price', 'id']),
         ]
     
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True)
     date_ordered = models.DateTimeField(auto_now_add=True)
     complete = models.BooleanField(default=False, null=True, blank=True)
+    # When payment completed the order; date_ordered is when the cart was opened
+    completed_at = models.DateTimeField(null=True, blank=True)
     transaction_id = models.CharField(max_length=255, null=True, blank=True, unique=True, db_index=True)
     razorpay_payment_id = models.CharField(max_length=300, null=True, blank=True)
     status = models.CharField(max_length=50, default='pending', choices=[
@@ -85,28 +97,27 @@ class Order(models.Model):
         ('delivered', 'Delivered'),
         ('cancelled', 'Cancelled'),
     ])
+    # Denormalized from the order's items, kept current by recalculate_totals()
+    total_amount = models.IntegerField(default=0)
+    item_count = models.IntegerField(default=0)
+    requires_shipping = models.BooleanField(default=False)
+
+    # SHA-256 of the rendered invoice HTML; names the cached PDF (see invoices.py)
+    invoice_digest = models.CharField(max_length=64, blank=True, default='')
+
+    TOTAL_FIELDS = ['total_amount', 'item_count', 'requires_shipping']
 
     @property
     def shipping(self):
-        shipping = False
-        orderitems = self.orderitem_set.all()
-        for item in orderitems:
-            if item.product and item.product.digital == False:
-                shipping = True
-
-        return shipping
+        return self.requires_shipping
 
     @property
     def get_cart_total(self):
-        orderitems = self.orderitem_set.all()
-        total = sum([item.get_total for item in orderitems])
-        return total
+        return self.total_amount
 
     @property
     def get_cart_items(self):
-        orderitems = self.orderitem_set.all()
-        total = sum([item.quantity for item in orderitems])
-        return total
+        return self.item_count
 
     def __str__(self):
         return str(self.id)
@@ -115,11 +126,45 @@ class Order(models.Model):
     def generate_transaction_id():
         """Generate unique transaction ID"""
         return str(uuid.uuid4())
+
+    def freeze_line_prices(self):
+        """Copy each line's current product price to ``unit_price``.
+
+        Call when the order completes, so reports keep valuing its lines at
+        what was charged after the product price changes.
+        """
+        price = Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]
+        return self.orderitem_set.filter(product__isnull=False).update(unit_price=Subquery(price))
+
+    @classmethod
+    def recalculate_totals(cls, order_ids, include_completed=False):
+        """Recompute stored totals for the given order ids in one UPDATE.
+
+        Totals are priced at today's product prices, so completed orders are
+        skipped and keep what was paid unless ``include_completed`` is set.
+        """
+        order_ids = list(order_ids)
+        if not order_ids:
+            return 0
+        orders = cls.objects.filter(pk__in=order_ids)
+        if not include_completed:
+            orders = orders.exclude(complete=True)
+        lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        total = lines.annotate(total=Sum(F('quantity') * F('product__price'))).values('total')
+        count = lines.annotate(count=Sum('quantity')).values('count')
+        return orders.update(
+            total_amount=Coalesce(Subquery(total), 0),
+            item_count=Coalesce(Subquery(count), 0),
+            requires_shipping=Exists(
+                OrderItem.objects.filter(order=OuterRef('pk'), product__digital=False)
+            ),
+        )
     
     class Meta:
         indexes = [
             models.Index(fields=['-date_ordered']),
             models.Index(fields=['customer', '-date_ordered']),
+            models.Index(fields=['completed_at']),
         ]
         constraints = [
             models.UniqueConstraint(
@@ -133,6 +178,8 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True)
     quantity = models.IntegerField(default=0, null=True, blank=True)
+    # Product price at completion (Order.freeze_line_prices); NULL on open carts
+    unit_price = models.IntegerField(null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
 
     @property
@@ -143,7 +190,82 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return self.product.name if self.product else "Deleted Product"
-    
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product')
+        ]
+
+
+class StockReservation(models.Model):
+    """Stock held for an order between checkout and payment"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'expires_at']),
+            models.Index(fields=['expires_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_reservation_per_order_product')
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x product {self.product_id} for order {self.order_id}"
+
+
+class Job(models.Model):
+    """Background work queued by apps.store.jobs and run by `manage.py run_jobs`"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+class DailySalesRollup(models.Model):
+    """Units and revenue per product per day, maintained by apps.store.reports"""
+    date = models.DateField()
+    # Kept when the product is deleted so history still adds up
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, related_name='daily_sales')
+    category = models.CharField(max_length=100, null=True, blank=True)
+    units = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_daily_sales_per_product')
+        ]
+
+    def __str__(self):
+        return f"{self.date}: {self.units} x product {self.product_id}"
 
 
 class ShippingAddress(models.Model):
@@ -160,6 +282,41 @@ class ShippingAddress(models.Model):
         return self.address
 
 
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_order_totals(sender, instance, **kwargs):
+    if not instance.order_id:
+        return
+    Order.recalculate_totals([instance.order_id])
+    # Keep an already-loaded order instance in step with the database
+    if OrderItem.order.is_cached(instance):
+        instance.order.refresh_from_db(fields=Order.TOTAL_FIELDS)
+
+
+@receiver(post_save, sender=Product)
+def refresh_open_order_totals(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and not {'price', 'digital'} & set(update_fields)):
+        return
+    # Price or digital flag may have changed; completed orders keep their totals
+    Order.recalculate_totals(
+        Order.objects.filter(complete=False, orderitem__product=instance)
+        .values_list('id', flat=True).distinct()
+    )
+
+
+@receiver(pre_delete, sender=Product)
+def collect_open_orders(sender, instance, **kwargs):
+    instance._open_order_ids = list(
+        Order.objects.filter(complete=False, orderitem__product=instance)
+        .values_list('id', flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=Product)
+def refresh_orders_after_product_delete(sender, instance, **kwargs):
+    Order.recalculate_totals(getattr(instance, '_open_order_ids', []))
+
+
 @receiver(post_save, sender=User)
 def create_customer(sender, instance, created, **kwargs):
     if created:
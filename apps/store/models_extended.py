@@ -2,6 +2,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from .models import Product, Customer
 
 class ProductReview(models.Model):
@@ -55,11 +56,13 @@ class Coupon(models.Model):
 class RecentlyViewed(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    viewed_at = models.DateTimeField(auto_now=True)
+    # Set explicitly by the buffered writer so flushes keep the real view time
+    viewed_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ('user', 'product')
         ordering = ['-viewed_at']
+        indexes = [models.Index(fields=['user', '-viewed_at'])]
 
     def __str__(self):
         return f"{self.user.username} viewed {self.product.name}"
@@ -0,0 +1,164 @@
+"""Pagination helpers for product listings"""
+import datetime
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import F, Q
+
+
+class CountedPaginator(Paginator):
+    """Paginator that reuses a count computed elsewhere instead of COUNT(*)"""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+# Sort orders usable with keyset pagination. Each ends with the primary key so
+# every row has a unique position, and each has a matching Product index.
+KEYSET_ORDERINGS = {
+    '-created_at': (('created_at', True), ('id', True)),
+    'price_low': (('price', False), ('id', False)),
+    'price_high': (('price', True), ('id', True)),
+    'popular': (('views', True), ('id', True)),
+}
+
+CURSOR_SALT = 'apps.store.pagination.cursor'
+
+
+def encode_cursor(values, backwards=False):
+    """Opaque, signed cursor for a row position"""
+    return signing.dumps([backwards, values], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    try:
+        backwards, values = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError) as e:
+        raise InvalidCursor(str(e))
+    return bool(backwards), values
+
+
+def _to_cursor_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def _from_cursor_value(field, value):
+    if field == 'created_at' and value is not None:
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def cursor_for(obj, sort, backwards=False):
+    """Cursor positioned at ``obj`` in the given keyset sort order"""
+    ordering = KEYSET_ORDERINGS[sort]
+    return encode_cursor([_to_cursor_value(getattr(obj, field)) for field, _ in ordering], backwards)
+
+
+def _after(ordering, values, backwards):
+    """Q selecting rows strictly after (or before) a position.
+
+    Built as ``a <= x AND (a < x OR (a = x AND ...))`` so the leading field
+    bounds a single index range instead of an OR of index lookups. Every
+    field compared here must be non-NULL.
+    """
+    (field, descending), value = ordering[0], values[0]
+    # Walking backwards flips every comparison
+    lookup = 'lt' if descending != backwards else 'gt'
+    if len(ordering) == 1:
+        return Q(**{f'{field}__{lookup}': value})
+    beyond = Q(**{f'{field}__{lookup}': value}) | (Q(**{field: value}) & _after(ordering[1:], values[1:], backwards))
+    return Q(**{f'{field}__{lookup}e': value}) & beyond
+
+
+def _order_by(ordering, backwards):
+    return [F(field).desc() if descending != backwards else F(field).asc() for field, descending in ordering]
+
+
+def _runs(queryset, ordering, values, backwards):
+    """(filter, order_by) pairs for the rows past the cursor, in page order.
+
+    A nullable leading field is read as two runs, its non-NULL values and its
+    NULLs, so neither query needs an IS NULL branch or a NULLS FIRST/LAST
+    sort and both can be served by an index. NULLs count as the smallest
+    value: last on descending sorts, first on ascending ones.
+    """
+    (lead, descending), rest = ordering[0], ordering[1:]
+    if not queryset.model._meta.get_field(lead).null:
+        condition = _after(ordering, values, backwards) if values is not None else Q()
+        return [(condition, _order_by(ordering, backwards))]
+
+    values_run = (Q(**{f'{lead}__isnull': False}), _order_by(ordering, backwards))
+    nulls_run = (Q(**{f'{lead}__isnull': True}), _order_by(rest, backwards))
+    # Walking towards smaller values reaches the NULLs last
+    runs = [values_run, nulls_run] if descending != backwards else [nulls_run, values_run]
+    if values is None:
+        return runs
+    if values[0] is None:
+        current, condition = nulls_run, _after(rest, values[1:], backwards)
+    else:
+        current, condition = values_run, _after(ordering, values, backwards)
+    return [(current[0] & condition, current[1])] + runs[runs.index(current) + 1:]
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset; no COUNT(*) is issued"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(queryset, sort, per_page, cursor=None):
+    """Fetch the page after (or before) ``cursor`` using indexed comparisons.
+
+    An invalid or tampered cursor falls back to the first page.
+    """
+    ordering = KEYSET_ORDERINGS[sort]
+    backwards, values = False, None
+    if cursor:
+        try:
+            backwards, values = decode_cursor(cursor)
+            values = [_from_cursor_value(field, v) for (field, _), v in zip(ordering, values)]
+        except (InvalidCursor, ValueError):
+            backwards, values = False, None
+
+    rows = []
+    for condition, order_by in _runs(queryset, ordering, values, backwards):
+        rows += queryset.filter(condition).order_by(*order_by)[:per_page + 1 - len(rows)]
+        if len(rows) > per_page:
+            break
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = cursor_for(rows[-1], sort)
+        if values is not None and (not backwards or has_more):
+            previous_cursor = cursor_for(rows[0], sort, backwards=True)
+    return KeysetPage(rows, next_cursor, previous_cursor)
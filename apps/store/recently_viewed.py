@@ -0,0 +1,137 @@
+"""Per-user recently viewed products kept in a capped cache list"""
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TTL = 60 * 60 * 24 * 30  # 30 days
+
+
+def history_limit():
+    return getattr(settings, 'RECENTLY_VIEWED_LIMIT', 12)
+
+
+def _history_key(user_id):
+    return f'recently_viewed_{user_id}'
+
+
+class RecentlyViewedBuffer:
+    """Collect recently viewed writes and persist them in bulk.
+
+    Writes are flushed on the same schedule as product view counts. Only the
+    newest ``RECENTLY_VIEWED_LIMIT`` rows per user are kept in the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, user_id, product_id):
+        with self._lock:
+            self._pending[(user_id, product_id)] = timezone.now()
+            due = (len(self._pending) >= getattr(settings, 'PRODUCT_VIEW_BUFFER_SIZE', 500) or
+                   time.monotonic() - self._last_flush >= getattr(settings, 'PRODUCT_VIEW_FLUSH_INTERVAL', 60))
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Upsert buffered views and prune history beyond the per-user limit"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        from .models_extended import RecentlyViewed
+        rows = [
+            RecentlyViewed(user_id=user_id, product_id=product_id, viewed_at=viewed_at)
+            for (user_id, product_id), viewed_at in pending.items()
+        ]
+        user_ids = {user_id for user_id, _ in pending}
+        # MySQL upserts on any unique key and takes no target fields
+        supports_target = connections[RecentlyViewed.objects.db].features.supports_update_conflicts_with_target
+        try:
+            with transaction.atomic():
+                RecentlyViewed.objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=['user', 'product'] if supports_target else None,
+                    update_fields=['viewed_at'],
+                )
+                prune_history(user_ids)
+        except Exception as e:
+            # Put the views back so the next flush retries them; views
+            # recorded since the swap are newer and win
+            with self._lock:
+                for key, viewed_at in pending.items():
+                    self._pending.setdefault(key, viewed_at)
+            logger.error(f"Failed to flush recently viewed products: {str(e)}")
+            return 0
+        return len(rows)
+
+
+def prune_history(user_ids, limit=None):
+    """Delete everything but the newest ``limit`` rows for each user"""
+    from .models_extended import RecentlyViewed
+    limit = limit or history_limit()
+    stale_ids = []
+    seen = {}
+    history = (RecentlyViewed.objects.filter(user_id__in=user_ids)
+               .order_by('user_id', '-viewed_at', '-id')
+               .values_list('id', 'user_id'))
+    for row_id, user_id in history:
+        seen[user_id] = seen.get(user_id, 0) + 1
+        if seen[user_id] > limit:
+            stale_ids.append(row_id)
+    if stale_ids:
+        RecentlyViewed.objects.filter(id__in=stale_ids).delete()
+    return len(stale_ids)
+
+
+recent_views = RecentlyViewedBuffer()
+
+
+def get_recently_viewed_ids(user_id):
+    """Newest-first product ids viewed by the user, at most RECENTLY_VIEWED_LIMIT"""
+    product_ids = cache.get(_history_key(user_id))
+    if product_ids is None:
+        from .models_extended import RecentlyViewed
+        product_ids = list(
+            RecentlyViewed.objects.filter(user_id=user_id)
+            .order_by('-viewed_at')
+            .values_list('product_id', flat=True)[:history_limit()]
+        )
+        cache.set(_history_key(user_id), product_ids, HISTORY_TTL)
+    return product_ids
+
+
+def record_recent_view(user_id, product_id):
+    """Push a product to the front of the user's history"""
+    product_ids = [pid for pid in get_recently_viewed_ids(user_id) if pid != product_id]
+    product_ids.insert(0, product_id)
+    cache.set(_history_key(user_id), product_ids[:history_limit()], HISTORY_TTL)
+    recent_views.record(user_id, product_id)
+
+
+def recently_viewed_products(user_id, exclude=None):
+    """Products for a recently viewed strip, in viewing order"""
+    from .models import Product
+    product_ids = [pid for pid in get_recently_viewed_ids(user_id) if pid != exclude]
+    if not product_ids:
+        return []
+    products = Product.objects.in_bulk(product_ids)
+    return [products[pid] for pid in product_ids if pid in products]
+
+
+def flush_recent_views():
+    return recent_views.flush()
+
+
+atexit.register(flush_recent_views)
@@ -0,0 +1,164 @@
+"""Sales reporting on the pre-aggregated DailySalesRollup table.
+
+Completing an order adds its lines to the rollup of the day it was paid,
+in the same transaction. ``manage.py backfill_sales_rollups`` rebuilds
+history from raw orders in chunks, and ``manage.py check_sales_rollups``
+compares the two.
+Reports read only the rollups, so they cost a scan of days x products
+rather than of every order line.
+
+Revenue is valued at each line's ``unit_price``, the product price frozen
+when the order completed, so later price changes neither show up in the
+check nor get rewritten by ``--fix``. Lines without one fall back to the
+product's current price.
+"""
+import datetime
+import logging
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import DailySalesRollup, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+def sale_date(order):
+    """Day an order's sales are reported under: the day it was paid"""
+    return timezone.localdate(order.completed_at or order.date_ordered)
+
+
+def day_start(day):
+    """Aware datetime of local midnight on ``day``, for index-friendly range filters"""
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _sales(lines):
+    return lines.filter(product__isnull=False).order_by().annotate(
+        units=Sum('quantity'),
+        revenue=Sum(F('quantity') * Coalesce('unit_price', 'product__price')),
+    )
+
+
+def order_lines(order):
+    """Units and revenue per product of one order"""
+    return _sales(
+        OrderItem.objects.filter(order=order).values('product_id', category=F('product__category'))
+    )
+
+
+def raw_sales(start, end):
+    """Rollup rows for days in [start, end), computed from completed orders"""
+    return _sales(
+        OrderItem.objects.filter(
+            order__complete=True,
+            order__completed_at__gte=day_start(start),
+            order__completed_at__lt=day_start(end),
+        ).values('product_id', day=TruncDate('order__completed_at'), category=F('product__category'))
+    )
+
+
+def record_order_sales(order):
+    """Add a newly completed order to its day's rollups.
+
+    Call inside the transaction that completes the order so the two commit
+    together. Each line is an increment on the existing row, or an insert
+    when the product has no sales that day yet.
+    """
+    day = sale_date(order)
+    with transaction.atomic():
+        for line in order_lines(order):
+            rollup = DailySalesRollup.objects.filter(date=day, product_id=line['product_id'])
+            increment = {'units': F('units') + line['units'], 'revenue': F('revenue') + (line['revenue'] or 0)}
+            if rollup.update(**increment):
+                continue
+            try:
+                with transaction.atomic():
+                    DailySalesRollup.objects.create(
+                        date=day,
+                        product_id=line['product_id'],
+                        category=line['category'],
+                        units=line['units'],
+                        revenue=line['revenue'] or 0,
+                    )
+            except IntegrityError:
+                # Another order created the row first
+                rollup.update(**increment)
+
+
+def rebuild(start, end):
+    """Replace the rollups of days in [start, end) with totals from raw orders.
+
+    Rows of deleted products are left alone, since their orders can no
+    longer be priced. Returns the number of rows written.
+    """
+    with transaction.atomic():
+        rows = [
+            DailySalesRollup(
+                date=row['day'],
+                product_id=row['product_id'],
+                category=row['category'],
+                units=row['units'],
+                revenue=row['revenue'] or 0,
+            )
+            for row in raw_sales(start, end)
+        ]
+        DailySalesRollup.objects.filter(date__gte=start, date__lt=end, product__isnull=False).delete()
+        DailySalesRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def date_chunks(start, end, chunk_days):
+    """Consecutive [chunk_start, chunk_end) windows covering [start, end)"""
+    while start < end:
+        chunk_end = min(start + datetime.timedelta(days=chunk_days), end)
+        yield start, chunk_end
+        start = chunk_end
+
+
+def find_mismatches(start, end):
+    """[(day, product_id, (units, revenue) from orders, (units, revenue) in rollups)]"""
+    expected = {
+        (row['day'], row['product_id']): (row['units'], row['revenue'] or 0)
+        for row in raw_sales(start, end)
+    }
+    actual = {
+        (day, product_id): (units, revenue)
+        for day, product_id, units, revenue in DailySalesRollup.objects.filter(
+            date__gte=start, date__lt=end, product__isnull=False
+        ).values_list('date', 'product_id', 'units', 'revenue')
+    }
+    return sorted(
+        (day, product_id, expected.get((day, product_id), (0, 0)), actual.get((day, product_id), (0, 0)))
+        for day, product_id in expected.keys() | actual.keys()
+        if expected.get((day, product_id), (0, 0)) != actual.get((day, product_id), (0, 0))
+    )
+
+
+def rollups(start, end):
+    return DailySalesRollup.objects.filter(date__gte=start, date__lt=end).order_by()
+
+
+def daily_sales(start, end):
+    """{day: {'units', 'revenue'}} for days in [start, end) that had sales"""
+    return {
+        row['date']: {'units': row['units'], 'revenue': row['revenue']}
+        for row in rollups(start, end).values('date').annotate(units=Sum('units'), revenue=Sum('revenue'))
+    }
+
+
+def sales_by_category(start, end):
+    return list(
+        rollups(start, end).values('category')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue', 'category')
+    )
+
+
+def top_products(start, end, limit=10):
+    return list(
+        rollups(start, end).filter(product__isnull=False)
+        .values('product_id', name=F('product__name'))
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue', 'product_id')[:limit]
+    )
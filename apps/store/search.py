@@ -0,0 +1,416 @@
+"""Product search backends for the store listing"""
+import logging
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Relevance weight of a term depending on the field it came from
+FIELD_WEIGHTS = {'name': 3.0, 'category': 2.0, 'description': 1.0}
+
+# Partial (prefix) matches score lower than whole-word matches
+PREFIX_FACTOR = 0.5
+
+# Cap on index terms a single query prefix may expand to
+MAX_PREFIX_EXPANSIONS = 50
+
+INDEX_VERSION_KEY = 'search_index_version'
+
+
+def tokenize(text):
+    """Lower-cased word tokens of a plain or HTML string"""
+    if not text:
+        return []
+    return TOKEN_RE.findall(strip_tags(text).lower())
+
+
+def max_results():
+    return getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+
+
+def index_max_age():
+    return getattr(settings, 'SEARCH_INDEX_MAX_AGE', 300)
+
+
+class VersionedIndex:
+    """Base for in-process indexes shared across workers by a cache version.
+
+    Each write bumps a version counter in the cache. A process applies its
+    own writes incrementally; any process that sees a version it did not
+    produce rebuilds from the database on next use. That only reaches other
+    processes through a shared cache (Redis, Memcached); with a per-process
+    cache such as LocMemCache the index is instead rebuilt once it is older
+    than ``SEARCH_INDEX_MAX_AGE`` seconds, which bounds how long writes made
+    in another worker stay invisible.
+    """
+
+    version_key = None
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._built_at = 0
+        self._version = None
+
+    def _current_version(self):
+        return cache.get(self.version_key, 0)
+
+    def _bump_version(self):
+        try:
+            return cache.incr(self.version_key)
+        except ValueError:
+            cache.add(self.version_key, 1, None)
+            return cache.get(self.version_key, 1)
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _add(self, product):
+        raise NotImplementedError
+
+    def _discard(self, product_id):
+        raise NotImplementedError
+
+    def _after_write(self):
+        pass
+
+    def rebuild(self):
+        with self._lock:
+            version = self._current_version()
+            self._reset()
+            self._load()
+            self._built = True
+            self._built_at = time.monotonic()
+            self._version = version
+
+    def _ensure_fresh(self):
+        if (
+            not self._built
+            or self._version != self._current_version()
+            or time.monotonic() - self._built_at > index_max_age()
+        ):
+            self.rebuild()
+
+    def _apply(self, product_id, product=None):
+        with self._lock:
+            version = self._bump_version()
+            if not self._built:
+                return
+            self._discard(product_id)
+            if product is not None:
+                self._add(product)
+            self._after_write()
+            if self._version == version - 1:
+                self._version = version
+
+    def index(self, product):
+        self._apply(product.id, product)
+
+    def remove(self, product_id):
+        self._apply(product_id)
+
+
+class InvertedIndexBackend(VersionedIndex):
+    """In-process inverted index over product name, description and category.
+
+    The index is built lazily from the database and kept current by the
+    product signals below.
+    """
+
+    version_key = INDEX_VERSION_KEY
+
+    def _reset(self):
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._categories = {}
+        self._sorted_terms = []
+
+    def _load(self):
+        from .models import Product
+        rows = Product.objects.values_list('id', 'name', 'description', 'category')
+        for row in rows.iterator(chunk_size=2000):
+            self._add_terms(*row)
+        self._sorted_terms = sorted(self._postings)
+
+    def _add_terms(self, product_id, name, description, category):
+        terms = defaultdict(float)
+        for field, text in (('name', name), ('category', category), ('description', description)):
+            for token in tokenize(text):
+                terms[token] += FIELD_WEIGHTS[field]
+        for term, weight in terms.items():
+            self._postings[term][product_id] = weight
+        self._doc_terms[product_id] = set(terms)
+        self._categories[product_id] = category
+
+    def _add(self, product):
+        self._add_terms(product.id, product.name, product.description, product.category)
+
+    def _discard(self, product_id):
+        for term in self._doc_terms.pop(product_id, ()):
+            docs = self._postings.get(term)
+            if docs is not None:
+                docs.pop(product_id, None)
+                if not docs:
+                    del self._postings[term]
+        self._categories.pop(product_id, None)
+
+    def _after_write(self):
+        self._sorted_terms = sorted(self._postings)
+
+    def _expand(self, token):
+        """Index terms matching a query token, with their match factor"""
+        matches = []
+        i = bisect_left(self._sorted_terms, token)
+        while i < len(self._sorted_terms) and len(matches) < MAX_PREFIX_EXPANSIONS:
+            term = self._sorted_terms[i]
+            if not term.startswith(token):
+                break
+            matches.append((term, 1.0 if term == token else PREFIX_FACTOR))
+            i += 1
+        return matches
+
+    def search(self, query, category=None):
+        """Product ids matching every query token, best match first"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        with self._lock:
+            self._ensure_fresh()
+            total_docs = max(len(self._doc_terms), 1)
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term, factor in self._expand(token):
+                    docs = self._postings[term]
+                    idf = 1.0 + math.log(total_docs / (1 + len(docs)))
+                    for product_id, weight in docs.items():
+                        score = weight * factor * idf
+                        if score > token_scores.get(product_id, 0):
+                            token_scores[product_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: scores[pid] + s for pid, s in token_scores.items() if pid in scores}
+                if not scores:
+                    return []
+
+            if category:
+                scores = {pid: s for pid, s in scores.items() if self._categories.get(pid) == category}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [product_id for product_id, _ in ranked[:max_results()]]
+
+
+class SuggestionIndex(VersionedIndex):
+    """Sorted prefix array of product names and categories for typeahead.
+
+    Every product contributes one key per word of its name, so "pho" finds
+    both "Phone Case" and "Galaxy Phone". Lookups are a bisect plus a bounded
+    scan of the matching range.
+    """
+
+    version_key = 'search_suggest_version'
+
+    # Upper bound on entries inspected per lookup
+    max_candidates = 200
+
+    def _reset(self):
+        self._keys = []
+        self._entries = []
+        self._product_keys = {}
+        self._category_counts = defaultdict(int)
+
+    def _load(self):
+        from .models import Product
+        rows = Product.objects.values_list('id', 'name', 'category', 'views')
+        for product_id, name, category, views in rows.iterator(chunk_size=2000):
+            self._add_entry(product_id, name, category, views)
+        order = sorted(range(len(self._keys)), key=self._keys.__getitem__)
+        self._keys = [self._keys[i] for i in order]
+        self._entries = [self._entries[i] for i in order]
+
+    @staticmethod
+    def _name_keys(name):
+        words = tokenize(name)
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    def _add_entry(self, product_id, name, category, views, sort=False):
+        keys = self._name_keys(name)
+        if category:
+            self._category_counts[category] += 1
+            if self._category_counts[category] == 1:
+                for key in self._name_keys(category):
+                    self._insert(key, ('category', category), sort)
+        for key in keys:
+            self._insert(key, ('product', product_id, name, views or 0), sort)
+        self._product_keys[product_id] = (keys, category)
+
+    def _insert(self, key, entry, sort):
+        if sort:
+            i = bisect_left(self._keys, key)
+            self._keys.insert(i, key)
+            self._entries.insert(i, entry)
+        else:
+            self._keys.append(key)
+            self._entries.append(entry)
+
+    def _remove_entry(self, key, match):
+        i = bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i] == key:
+            if match(self._entries[i]):
+                del self._keys[i]
+                del self._entries[i]
+                return
+            i += 1
+
+    def _add(self, product):
+        self._add_entry(product.id, product.name, product.category, product.views, sort=True)
+
+    def _discard(self, product_id):
+        keys, category = self._product_keys.pop(product_id, ((), None))
+        for key in keys:
+            self._remove_entry(key, lambda e: e[0] == 'product' and e[1] == product_id)
+        if category:
+            self._category_counts[category] -= 1
+            if self._category_counts[category] <= 0:
+                del self._category_counts[category]
+                for key in self._name_keys(category):
+                    self._remove_entry(key, lambda e: e[0] == 'category' and e[1] == category)
+
+    def suggest(self, prefix, limit=8):
+        """Top product and category suggestions for a typed prefix"""
+        prefix = ' '.join(tokenize(prefix))
+        if not prefix:
+            return []
+
+        with self._lock:
+            self._ensure_fresh()
+            products = {}
+            categories = {}
+            i = bisect_left(self._keys, prefix)
+            end = min(i + self.max_candidates, len(self._keys))
+            while i < end and self._keys[i].startswith(prefix):
+                entry = self._entries[i]
+                if entry[0] == 'product':
+                    products[entry[1]] = entry
+                else:
+                    categories[entry[1]] = self._category_counts.get(entry[1], 0)
+                i += 1
+
+        suggestions = [
+            {'type': 'category', 'name': name, 'count': count}
+            for name, count in sorted(categories.items(), key=lambda c: -c[1])[:2]
+        ]
+        ranked = sorted(products.values(), key=lambda e: (-e[3], e[2] or ''))
+        suggestions += [
+            {'type': 'product', 'id': product_id, 'name': name}
+            for _, product_id, name, _ in ranked[:max(limit - len(suggestions), 0)]
+        ]
+        return suggestions
+
+
+class DatabaseFullTextBackend:
+    """Native full-text search: MySQL FULLTEXT or SQLite FTS5.
+
+    Relies on the index created by migration 0015; the database keeps it up
+    to date, so index() and remove() are no-ops.
+    """
+
+    def index(self, product):
+        pass
+
+    def remove(self, product_id):
+        pass
+
+    def search(self, query, category=None):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        if connection.vendor == 'mysql':
+            sql = (
+                "SELECT id FROM store_product "
+                "WHERE MATCH(name, description, category) AGAINST (%s IN BOOLEAN MODE)"
+            )
+            params = [' '.join(f'+{token}*' for token in tokens)]
+            if category:
+                sql += " AND category = %s"
+                params.append(category)
+            sql += " ORDER BY MATCH(name, description, category) AGAINST (%s IN BOOLEAN MODE) DESC, id DESC LIMIT %s"
+            params += [params[0], max_results()]
+        elif connection.vendor == 'sqlite':
+            sql = (
+                "SELECT f.rowid FROM store_product_fts f "
+                "JOIN store_product p ON p.id = f.rowid "
+                "WHERE store_product_fts MATCH %s"
+            )
+            params = [' '.join(f'"{token}"*' for token in tokens)]
+            if category:
+                sql += " AND p.category = %s"
+                params.append(category)
+            sql += " ORDER BY bm25(store_product_fts, 3.0, 1.0, 2.0), f.rowid DESC LIMIT %s"
+            params.append(max_results())
+        else:
+            raise NotImplementedError(f"No full-text search support for {connection.vendor}")
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+_backend = None
+suggestions = SuggestionIndex()
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'SEARCH_BACKEND', 'apps.store.search.InvertedIndexBackend')
+        _backend = import_string(backend_path)()
+    return _backend
+
+
+def search_products(query, category=None):
+    """Ranked product ids for a search query"""
+    return get_search_backend().search(query, category=category)
+
+
+def suggest(prefix, limit=8):
+    return suggestions.suggest(prefix, limit=limit)
+
+
+@receiver(post_save, sender='store.Product')
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'name', 'description', 'category'} & set(update_fields):
+        return
+    try:
+        get_search_backend().index(instance)
+        suggestions.index(instance)
+    except Exception as e:
+        logger.error(f"Failed to index product {instance.id}: {str(e)}")
+
+
+@receiver(post_delete, sender='store.Product')
+def unindex_product(sender, instance, **kwargs):
+    try:
+        get_search_backend().remove(instance.id)
+        suggestions.remove(instance.id)
+    except Exception as e:
+        logger.error(f"Failed to remove product {instance.id} from search index: {str(e)}")
@@ -1,112 +1,231 @@
 """Security middleware for additional protection"""
 import logging
+import re
+import secrets
+import time
 from django.utils.deprecation import MiddlewareMixin
-from django.http import HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    from whitenoise.middleware import WhiteNoiseFileResponse
+except ImportError:
+    WhiteNoiseFileResponse = None
 
 logger = logging.getLogger(__name__)
 
 class SecurityHeadersMiddleware(MiddlewareMixin):
-    """Add security headers to all responses"""
-    
+    """Add security headers to all responses.
+
+    The header set is built once from settings. ``SECURITY_HEADERS`` adds to
+    or replaces the defaults below and ``CONTENT_SECURITY_POLICY`` maps
+    directives to their sources. ``CONTENT_SECURITY_POLICY_OVERRIDES`` is a
+    list of ``(path_prefix, directives)`` merged over the base policy for
+    matching paths, first match wins. A ``{nonce}`` placeholder in a source
+    is replaced per request by a fresh nonce, available to templates as
+    ``request.csp_nonce``. Files served by WhiteNoise are left untouched.
+    """
+
+    DEFAULT_HEADERS = {
+        'X-Frame-Options': 'DENY',
+        'X-Content-Type-Options': 'nosniff',
+        'X-XSS-Protection': '1; mode=block',
+        'Referrer-Policy': 'strict-origin-when-cross-origin',
+        'Permissions-Policy': 'geolocation=(), microphone=(), camera=(), payment=()',
+    }
+
+    DEFAULT_POLICY = {
+        'default-src': ["'self'"],
+        'script-src': ["'self'", "'unsafe-inline'", 'cdn.jsdelivr.net'],
+        'style-src': ["'self'", "'unsafe-inline'", 'cdn.jsdelivr.net'],
+        'img-src': ["'self'", 'data:', 'https:'],
+        'font-src': ["'self'", 'cdn.jsdelivr.net'],
+        'connect-src': ["'self'"],
+        'frame-ancestors': ["'none'"],
+    }
+
+    NONCE_PLACEHOLDER = '{nonce}'
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        from django.conf import settings
+        headers = {**self.DEFAULT_HEADERS, **getattr(settings, 'SECURITY_HEADERS', {})}
+        policy = getattr(settings, 'CONTENT_SECURITY_POLICY', self.DEFAULT_POLICY)
+        self.default_route = self._build(headers, policy)
+        self.routes = [
+            (prefix if isinstance(prefix, str) else tuple(prefix), self._build(headers, {**policy, **directives}))
+            for prefix, directives in getattr(settings, 'CONTENT_SECURITY_POLICY_OVERRIDES', [])
+        ]
+
+    @classmethod
+    def _build(cls, headers, policy):
+        """Precomputed headers for one route and whether it needs a nonce"""
+        csp = '; '.join(f"{name} {' '.join(sources)}" for name, sources in policy.items()) + ';'
+        return {**headers, 'Content-Security-Policy': csp}, cls.NONCE_PLACEHOLDER in csp
+
+    def _route_for(self, path):
+        for prefix, route in self.routes:
+            if path.startswith(prefix):
+                return route
+        return self.default_route
+
+    def process_request(self, request):
+        _, needs_nonce = self._route_for(request.path_info)
+        if needs_nonce:
+            request.csp_nonce = secrets.token_urlsafe(16)
+        return None
+
     def process_response(self, request, response):
-        # Prevent clickjacking
-        response['X-Frame-Options'] = 'DENY'
-        
-        # Prevent MIME type sniffing
-        response['X-Content-Type-Options'] = 'nosniff'
-        
-        # Enable XSS protection
-        response['X-XSS-Protection'] = '1; mode=block'
-        
-        # Content Security Policy
-        response['Content-Security-Policy'] = (
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline' cdn.jsdelivr.net; "
-            "style-src 'self' 'unsafe-inline' cdn.jsdelivr.net; "
-            "img-src 'self' data: https:; "
-            "font-src 'self' cdn.jsdelivr.net; "
-            "connect-src 'self'; "
-            "frame-ancestors 'none';"
-        )
-        
-        # Referrer Policy
-        response['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-        
-        # Permissions Policy
-        response['Permissions-Policy'] = (
-            'geolocation=(), '
-            'microphone=(), '
-            'camera=(), '
-            'payment=()'
-        )
-        
+        if WhiteNoiseFileResponse is not None and isinstance(response, WhiteNoiseFileResponse):
+            return response
+
+        headers, needs_nonce = self._route_for(request.path_info)
+        for name, value in headers.items():
+            response.headers[name] = value
+        if needs_nonce:
+            csp = headers['Content-Security-Policy']
+            nonce = getattr(request, 'csp_nonce', None)
+            if nonce:
+                csp = csp.replace(self.NONCE_PLACEHOLDER, nonce)
+            else:
+                # No nonce was issued (an earlier middleware answered), so
+                # drop the nonce sources rather than send the placeholder
+                csp = csp.replace(f" 'nonce-{self.NONCE_PLACEHOLDER}'", '')
+            response.headers['Content-Security-Policy'] = csp
         return response
 
 class RateLimitMiddleware(MiddlewareMixin):
-    """Rate limiting middleware"""
-    
+    """Sliding-window rate limiting per client IP and route.
+
+    Each request costs one atomic ``cache.incr`` on the current fixed window;
+    the previous window's final count is weighted by how much of it still
+    overlaps the sliding window. Works with any cache backend that supports
+    incr/add, including LocMemCache.
+
+    Budgets come from ``RATE_LIMIT_RULES``: a list of
+    ``(path_prefix, max_requests, window_seconds)`` where the first matching
+    prefix wins. Paths under ``RATE_LIMIT_EXEMPT`` (static and media by
+    default) are never counted.
+    """
+
+    DEFAULT_RULES = [('/', 100, 60)]
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        from django.conf import settings
+        self.rules = [tuple(rule) for rule in getattr(settings, 'RATE_LIMIT_RULES', self.DEFAULT_RULES)]
+        exempt = getattr(settings, 'RATE_LIMIT_EXEMPT', None)
+        if exempt is None:
+            exempt = [settings.STATIC_URL, settings.MEDIA_URL]
+        self.exempt = tuple('/' + prefix.lstrip('/') for prefix in exempt if prefix)
+        # Final counts of already closed windows, keyed by window key
+        self._closed_windows = {}
+
+    def _client_ip(self, request):
+        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            return x_forwarded_for.split(',')[0].strip()
+        return request.META.get('REMOTE_ADDR')
+
+    def _rule_for(self, path):
+        for prefix, limit, window in self.rules:
+            if path.startswith(prefix):
+                return prefix, limit, window
+        return None
+
+    def _previous_count(self, cache, key):
+        count = self._closed_windows.get(key)
+        if count is None:
+            count = cache.get(key, 0)
+            if len(self._closed_windows) > 10000:
+                self._closed_windows.clear()
+            self._closed_windows[key] = count
+        return count
+
     def process_request(self, request):
         from django.core.cache import cache
         
-        # Get client IP
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
+        path = request.path
+        if path.startswith(self.exempt):
+            return None
+        rule = self._rule_for(path)
+        if rule is None:
+            return None
+        prefix, limit, window = rule
         
-        # Rate limit key
-        cache_key = f'rate_limit_{ip}'
-        requests = cache.get(cache_key, 0)
+        ip = self._client_ip(request)
+        now = time.time()
+        current = int(now // window)
+        base_key = f'rate_limit:{prefix}:{ip}'
+        key = f'{base_key}:{current}'
         
-        # Allow 100 requests per minute
-        if requests > 100:
-            logger.warning(f"Rate limit exceeded for IP: {ip}")
-            return HttpResponseForbidden("Rate limit exceeded")
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # First hit in this window; add() loses to a concurrent first hit
+            if cache.add(key, 1, window * 2):
+                count = 1
+            else:
+                count = cache.incr(key)
         
-        cache.set(cache_key, requests + 1, 60)
-        return None
-
-class SQLInjectionProtectionMiddleware(MiddlewareMixin):
-    """Detect and prevent SQL injection attempts"""
-    
-    SQL_KEYWORDS = ['DROP', 'DELETE', 'INSERT', 'UPDATE', 'UNION', 'SELECT', 'EXEC', 'EXECUTE']
-    
-    def process_request(self, request):
-        # Check GET parameters
-        for key, value in request.GET.items():
-            if self._contains_sql_injection(str(value)):
-                logger.warning(f"Potential SQL injection detected from IP: {request.META.get('REMOTE_ADDR')}")
-                return HttpResponseForbidden("Invalid request")
+        elapsed = (now % window) / window
+        previous = self._previous_count(cache, f'{base_key}:{current - 1}')
+        estimated = count + previous * (1 - elapsed)
         
+        if estimated > limit:
+            logger.warning(f"Rate limit exceeded for IP: {ip} on {prefix}")
+            response = HttpResponse("Rate limit exceeded", status=429)
+            response['Retry-After'] = str(int(window - now % window) + 1)
+            return response
         return None
-    
-    def _contains_sql_injection(self, value):
-        """Check if value contains SQL injection patterns"""
-        value_upper = value.upper()
-        for keyword in self.SQL_KEYWORDS:
-            if keyword in value_upper and any(char in value for char in ['--', ';', '/*', '*/']):
-                return True
-        return False
-
-class XSSProtectionMiddleware(MiddlewareMixin):
-    """Detect and prevent XSS attempts"""
-    
-    XSS_PATTERNS = ['<script', 'javascript:', 'onerror=', 'onload=', '<iframe', '<object', '<embed']
-    
+
+class RequestInspectionMiddleware(MiddlewareMixin):
+    """Detect SQL injection and XSS attempts in GET parameters.
+
+    All values are screened in one pass for the characters every pattern
+    needs (``< : = - ; / *``); requests without them are let through
+    immediately. Only values that contain one are matched against the
+    precompiled pattern sets, and at most ``INSPECT_MAX_LENGTH`` characters
+    of each value are examined.
+    """
+
+    INSPECT_MAX_LENGTH = 4096
+
+    # Characters at least one of which every pattern below requires
+    TRIGGER_RE = re.compile(r'[<:=;/*]|--')
+
+    # A value is flagged for SQL injection when it has both a keyword and a
+    # comment/statement separator (EXEC also covers EXECUTE)
+    SQL_KEYWORD_RE = re.compile(r'DROP|DELETE|INSERT|UPDATE|UNION|SELECT|EXEC', re.IGNORECASE)
+    SQL_META_RE = re.compile(r'--|;|/\*|\*/')
+
+    XSS_RE = re.compile(
+        r'<script|javascript:|onerror=|onload=|<iframe|<object|<embed', re.IGNORECASE
+    )
+
     def process_request(self, request):
-        # Check GET parameters
-        for key, value in request.GET.items():
-            if self._contains_xss(str(value)):
+        if not request.GET:
+            return None
+
+        limit = self.INSPECT_MAX_LENGTH
+        # lists() so every value of a repeated key is inspected, not just the last
+        values = [value[:limit] for _, key_values in request.GET.lists() for value in key_values]
+        if not self.TRIGGER_RE.search('\n'.join(values)):
+            return None
+
+        for value in values:
+            if not self.TRIGGER_RE.search(value):
+                continue
+            if self.XSS_RE.search(value):
                 logger.warning(f"Potential XSS detected from IP: {request.META.get('REMOTE_ADDR')}")
                 return HttpResponseForbidden("Invalid request")
-        
+            if self.SQL_META_RE.search(value) and self.SQL_KEYWORD_RE.search(value):
+                logger.warning(f"Potential SQL injection detected from IP: {request.META.get('REMOTE_ADDR')}")
+                return HttpResponseForbidden("Invalid request")
+
         return None
-    
-    def _contains_xss(self, value):
-        """Check if value contains XSS patterns"""
-        value_lower = value.lower()
-        for pattern in self.XSS_PATTERNS:
-            if pattern in value_lower:
-                return True
-        return False
+
+
+# Previous names, kept so existing MIDDLEWARE settings keep working. List only
+# one of them: each runs the full inspection.
+SQLInjectionProtectionMiddleware = RequestInspectionMiddleware
+XSSProtectionMiddleware = RequestInspectionMiddleware
@@ -0,0 +1,57 @@
+"""Background job handlers; see apps.store.jobs"""
+from django.db import connection, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .cart import invalidate_cart
+from .invoices import ensure_invoice, invoice_orders
+from .jobs import enqueue, job
+from .models import Order, OrderItem
+from .utils import send_order_confirmation_email
+
+
+@job('send_order_confirmation')
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('customer').filter(pk=order_id, complete=True).first()
+    if order is None or not order.customer or not order.customer.email:
+        return
+    send_order_confirmation_email(order.customer.email, order)
+
+
+@job('render_invoice')
+def render_invoice(order_id):
+    order = invoice_orders().filter(pk=order_id).first()
+    if order is not None:
+        ensure_invoice(order)
+
+
+@job('purge_orphan_items')
+def purge_orphan_items(batch_size=1000):
+    """Delete open-cart lines whose product was deleted; returns how many went.
+
+    Lines of completed orders stay so invoices and order history still show
+    them. Each batch is one DELETE that bypasses the OrderItem signals, and
+    the affected carts are then recalculated once each.
+    """
+    total = 0
+    while True:
+        rows = list(
+            OrderItem.objects.filter(product__isnull=True, order__complete=False)
+            .values_list('id', 'order_id', 'order__customer__user_id')[:batch_size]
+        )
+        if not rows:
+            return total
+        with transaction.atomic(), connection.cursor() as cursor:
+            ids = [row[0] for row in rows]
+            cursor.execute(
+                f"DELETE FROM {OrderItem._meta.db_table} WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                ids,
+            )
+            total += cursor.rowcount
+            Order.recalculate_totals({order_id for _, order_id, _ in rows})
+            for user_id in {user_id for _, _, user_id in rows}:
+                invalidate_cart(user_id)
+
+
+@receiver(post_delete, sender='store.Product')
+def purge_after_product_delete(sender, instance, **kwargs):
+    enqueue('purge_orphan_items')
@@ -3,6 +3,7 @@ from django.test import TestCase, Client
 from django.contrib.auth.models import User
 from apps.store.models import Product, Customer, Order, OrderItem
 from decimal import Decimal
+import json
 
 class ProductModelTest(TestCase):
     def setUp(self):
@@ -49,6 +50,59 @@ class OrderModelTest(TestCase):
         OrderItem.objects.create(order=self.order, product=self.product, quantity=3)
         self.assertEqual(self.order.get_cart_items, 3)
 
+    def test_totals_follow_item_changes(self):
+        item = OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+        item.quantity = 4
+        item.save()
+        order = Order.objects.get(id=self.order.id)
+        self.assertEqual((order.total_amount, order.item_count), (4000, 4))
+        self.assertTrue(order.shipping)
+
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.item_count), (0, 0))
+        self.assertFalse(order.shipping)
+
+    def test_price_change_updates_open_orders(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        self.product.price = 1500
+        self.product.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.get_cart_total, 3000)
+
+    def test_rebuild_order_totals_command(self):
+        from django.core.management import call_command
+        from io import StringIO
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        Order.objects.filter(id=self.order.id).update(total_amount=0, item_count=0)
+        call_command('rebuild_order_totals', batch_size=1, stdout=StringIO())
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_amount, self.order.item_count), (2000, 2))
+
+    def test_completed_orders_keep_paid_totals(self):
+        from django.core.management import call_command
+        from io import StringIO
+        other = Product.objects.create(name="Other", price=500, stock=10)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+        OrderItem.objects.create(order=self.order, product=other, quantity=1)
+        self.order.complete = True
+        self.order.save()
+        self.product.price = 9000
+        self.product.save()
+        OrderItem.objects.filter(order=self.order, product=other).first().delete()
+        call_command('rebuild_order_totals', stdout=StringIO())
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_amount, self.order.item_count), (1500, 2))
+
+    def test_rebuild_fills_completed_orders_without_totals(self):
+        from django.core.management import call_command
+        from io import StringIO
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        Order.objects.filter(id=self.order.id).update(complete=True, total_amount=0, item_count=0)
+        call_command('rebuild_order_totals', stdout=StringIO())
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_amount, self.order.item_count), (2000, 2))
+
 class ViewsTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -57,6 +111,10 @@ class ViewsTest(TestCase):
         Customer.objects.get_or_create(user=self.user, defaults={'name': self.user.username, 'email': self.user.email})
         self.product = Product.objects.create(name="Test Product", price=1000, stock=10)
 
+    def tearDown(self):
+        from apps.store.counters import flush_product_views
+        flush_product_views()
+
     def test_store_view(self):
         response = self.client.get('/')
         self.assertEqual(response.status_code, 200)
@@ -76,3 +134,1297 @@ class ViewsTest(TestCase):
             data='{"productId": ' + str(self.product.id) + ', "action": "add"}',
             content_type='application/json')
         self.assertEqual(response.status_code, 200)
+
+class CookieCartTest(TestCase):
+    def setUp(self):
+        from django.test import RequestFactory
+        self.factory = RequestFactory()
+        self.products = [
+            Product.objects.create(name=f"Product {i}", price=100 * (i + 1), stock=10)
+            for i in range(3)
+        ]
+
+    def _request(self, cart):
+        import json
+        request = self.factory.get('/cart/')
+        request.COOKIES['cart'] = json.dumps(cart)
+        return request
+
+    def test_resolves_cart_in_one_query(self):
+        from apps.store.utils import cookieCart
+        request = self._request({str(p.id): {'quantity': 2} for p in self.products})
+        with self.assertNumQueries(1):
+            data = cookieCart(request)
+            cookieCart(request)
+        self.assertEqual(data['cartItems'], 6)
+        self.assertEqual(data['order']['get_cart_total'], 1200)
+        self.assertEqual(len(data['items']), 3)
+
+    def test_invalid_lines_are_dropped_and_counted(self):
+        from apps.store.utils import cookieCart
+        request = self._request({
+            str(self.products[0].id): {'quantity': 1},
+            '999999': {'quantity': 1},
+            'abc': {'quantity': 1},
+            str(self.products[1].id): {'quantity': 'x'},
+        })
+        data = cookieCart(request)
+        self.assertEqual(data['cartItems'], 1)
+        self.assertEqual(data['droppedItems'], 3)
+
+    def test_malformed_cookie(self):
+        from apps.store.utils import cookieCart
+        request = self.factory.get('/cart/')
+        request.COOKIES['cart'] = 'not json'
+        with self.assertNumQueries(0):
+            data = cookieCart(request)
+        self.assertEqual(data['items'], [])
+
+class CartSummaryTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user('cartuser', 'cart@test.com', 'password')
+        self.product = Product.objects.create(name="Test Product", price=1000, stock=10)
+
+    def test_cached_count_costs_no_queries(self):
+        from apps.store.cart import cart_item_count
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=2)
+        self.assertEqual(cart_item_count(self.user), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_item_count(self.user), 2)
+
+    def test_count_cached_briefly(self):
+        from unittest import mock
+        from apps.store.cache import CART_COUNT_TTL
+        from apps.store.cart import cart_item_count
+        with mock.patch('apps.store.cache.cache.set') as cache_set:
+            cart_item_count(self.user)
+        cache_set.assert_called_once_with(f'cart_count_{self.user.id}', 0, CART_COUNT_TTL)
+        self.assertLessEqual(CART_COUNT_TTL, 60)
+
+    def test_update_item_invalidates_count(self):
+        from apps.store.cart import cart_item_count
+        self.assertEqual(cart_item_count(self.user), 0)
+        self.client.login(username='cartuser', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/update-item/',
+                data='{"productId": ' + str(self.product.id) + ', "action": "add"}',
+                content_type='application/json')
+        self.assertEqual(cart_item_count(self.user), 1)
+
+class CartMutationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shop@test.com', 'password')
+        self.product = Product.objects.create(name="Hot Item", price=250, stock=2)
+        self.client.login(username='shopper', password='password')
+
+    def _post(self, action):
+        return self.client.post('/update-item/',
+            data=json.dumps({'productId': self.product.id, 'action': action}),
+            content_type='application/json')
+
+    def test_add_and_remove_keep_totals_current(self):
+        self.assertEqual(self._post('add').json()['items'], [{'productId': self.product.id, 'quantity': 1}])
+        self.assertEqual(self._post('add').json()['cartItems'], 2)
+        order = Order.objects.get(customer__user=self.user, complete=False)
+        self.assertEqual((order.item_count, order.total_amount), (2, 500))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 1)
+
+        self._post('remove')
+        self._post('remove')
+        order.refresh_from_db()
+        self.assertFalse(OrderItem.objects.filter(order=order).exists())
+        self.assertEqual((order.item_count, order.total_amount), (0, 0))
+
+    def test_add_beyond_stock_rejected(self):
+        self._post('add')
+        self._post('add')
+        response = self._post('add')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Insufficient stock', response.json()['error'])
+
+    def test_checkout_enforces_stock(self):
+        from apps.store.cart import apply_changes
+        order = apply_changes(self.user, [{'productId': self.product.id, 'quantity': 2}])
+        # Stock sold elsewhere after the item went into the cart
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        response = self.client.post('/process-order/',
+            data=json.dumps({'form': {'total': '500'}, 'shipping': {}}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Insufficient stock', response.json()['error'])
+        order.refresh_from_db()
+        self.assertFalse(order.complete)
+
+class BulkCartUpdateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('bulkshopper', 'bulk@test.com', 'password')
+        self.products = [Product.objects.create(name=f"Item {i}", price=100, stock=5) for i in range(3)]
+        self.client.login(username='bulkshopper', password='password')
+
+    def _patch(self, changes):
+        return self.client.patch('/api/cart/', data=json.dumps({'changes': changes}),
+                                 content_type='application/json')
+
+    def test_applies_many_changes_in_one_request(self):
+        a, b, c = self.products
+        self._patch([{'productId': a.id, 'quantity': 2}, {'productId': b.id, 'quantity': 1}])
+        response = self._patch([
+            {'productId': a.id, 'quantity': 0},
+            {'productId': b.id, 'delta': 2},
+            {'productId': c.id, 'quantity': 4},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['items'], [{'productId': b.id, 'quantity': 3}, {'productId': c.id, 'quantity': 4}])
+        self.assertEqual((data['cartItems'], data['cartTotal']), (7, 700))
+
+    def test_query_count_independent_of_line_count(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def queries_for(products):
+            self._patch([{'productId': p.id, 'quantity': 0} for p in self.products])
+            with CaptureQueriesContext(connection) as ctx:
+                self._patch([{'productId': p.id, 'quantity': 1} for p in products])
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries_for(self.products[:1]), queries_for(self.products))
+
+    def test_delta_on_new_line_adds_to_concurrent_insert(self):
+        from apps.store.cart import _add_to_new_lines, open_order
+        a, b = self.products[:2]
+        self._patch([{'productId': a.id, 'delta': 1}])
+        order = open_order(self.user)
+        # Another request inserted the line after this one saw it missing
+        _add_to_new_lines(order, {a.id: 1, b.id: 2})
+        self.assertEqual(
+            dict(OrderItem.objects.filter(order=order).values_list('product_id', 'quantity')),
+            {a.id: 2, b.id: 2},
+        )
+
+    def test_rejects_whole_batch_on_short_stock(self):
+        a, b = self.products[:2]
+        response = self._patch([{'productId': a.id, 'quantity': 1}, {'productId': b.id, 'quantity': 6}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Only 5 available', response.json()['error'])
+        self.assertFalse(OrderItem.objects.filter(order__customer__user=self.user).exists())
+
+    def test_invalid_and_unknown_products(self):
+        self.assertEqual(self._patch([{'productId': 'x'}]).status_code, 400)
+        self.assertEqual(self._patch([{'productId': 999999, 'quantity': 1}]).status_code, 404)
+        self.assertEqual(self.client.post('/api/cart/').status_code, 405)
+
+class CartMergeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('returning', 'back@test.com', 'password')
+        self.products = [Product.objects.create(name=f"Item {i}", price=100, stock=3) for i in range(30)]
+
+    def _login(self, cart):
+        self.client.cookies['cart'] = json.dumps(cart)
+        return self.client.post('/l/', {'username': 'returning', 'password': 'password'})
+
+    def test_login_merges_cookie_cart_once(self):
+        a, b = self.products[:2]
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=a, quantity=2)
+        cart = {str(a.id): {'quantity': 1}, str(b.id): {'quantity': 5}, '999999': {'quantity': 1}}
+
+        response = self._login(cart)
+        self.assertEqual(response.cookies['cart']['max-age'], 0)
+        lines = dict(OrderItem.objects.filter(order=order).values_list('product_id', 'quantity'))
+        self.assertEqual(lines, {a.id: 2, b.id: 3})
+        order.refresh_from_db()
+        self.assertEqual(order.item_count, 5)
+
+        self.client.logout()
+        self._login(cart)
+        lines_again = dict(OrderItem.objects.filter(order=order).values_list('product_id', 'quantity'))
+        self.assertEqual(lines_again, lines)
+
+    def test_merge_query_count_independent_of_cart_size(self):
+        from django.db import connection
+        from django.test import RequestFactory
+        from django.test.utils import CaptureQueriesContext
+        from apps.store.cart import merge_cookie_cart
+        Order.objects.create(customer=self.user.customer)
+
+        def queries_for(products):
+            OrderItem.objects.all().delete()
+            request = RequestFactory().get('/')
+            request.COOKIES['cart'] = json.dumps({str(p.id): {'quantity': 1} for p in products})
+            with CaptureQueriesContext(connection) as ctx:
+                merge_cookie_cart(request, self.user)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries_for(self.products[:2]), queries_for(self.products))
+
+    def test_login_survives_failed_merge(self):
+        from unittest import mock
+        from django.db import IntegrityError
+        cart = {str(self.products[0].id): {'quantity': 1}}
+        with mock.patch('apps.loginsys.views.merge_cookie_cart', side_effect=IntegrityError('FOREIGN KEY')), \
+                self.assertLogs('apps.loginsys.views', level='ERROR'):
+            response = self._login(cart)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.user.id)
+        self.assertNotIn('cart', response.cookies)
+
+class InventoryTest(TestCase):
+    def setUp(self):
+        self.a = Product.objects.create(name="Alpha", price=100, stock=5)
+        self.b = Product.objects.create(name="Beta", price=100, stock=1)
+
+    def test_decrements_with_one_update_per_product(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from apps.store.inventory import decrement_stock
+        with CaptureQueriesContext(connection) as ctx:
+            decrement_stock({self.a.id: 2, self.b.id: 1})
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(
+            dict(Product.objects.values_list('id', 'stock')), {self.a.id: 3, self.b.id: 0}
+        )
+
+    def test_short_product_rolls_back_everything(self):
+        from apps.store.inventory import InsufficientStock, decrement_stock
+        with self.assertRaises(InsufficientStock) as ctx:
+            decrement_stock({self.a.id: 2, self.b.id: 2})
+        self.assertIn('Beta', ctx.exception.messages[0])
+        self.assertEqual(
+            dict(Product.objects.values_list('id', 'stock')), {self.a.id: 5, self.b.id: 1}
+        )
+
+    def test_process_order_takes_stock(self):
+        user = User.objects.create_user('buyer', 'buyer@test.com', 'password')
+        order = Order.objects.create(customer=user.customer)
+        OrderItem.objects.create(order=order, product=self.a, quantity=3)
+        self.client.login(username='buyer', password='password')
+        response = self.client.post('/process-order/',
+            data=json.dumps({'form': {'total': '300'}, 'shipping': {
+                'address': 'x', 'city': 'y', 'state': 'z', 'zipcode': '1'}}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.stock, 2)
+
+    def test_rejected_guest_checkout_leaves_no_order(self):
+        self.client.cookies['cart'] = json.dumps({str(self.b.id): {'quantity': 2}})
+        response = self.client.post('/process-order/',
+            data=json.dumps({'form': {'name': 'Guest', 'email': 'guest@test.com',
+                                      'total': str(self.b.price * 2)}}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.product = Product.objects.create(name="Limited", price=100, stock=3)
+        self.first = self._order('first', 2)
+        self.second = self._order('second', 2)
+
+    def _order(self, username, quantity):
+        user = User.objects.create_user(username, f'{username}@test.com', 'password')
+        order = Order.objects.create(customer=user.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity)
+        return order
+
+    def test_holds_prevent_overselling(self):
+        from apps.store.inventory import InsufficientStock, apply_holds, reserve
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve(self.first)
+        with self.assertRaises(InsufficientStock):
+            reserve(self.second)
+        product = apply_holds([Product.objects.get(pk=self.product.pk)])[0]
+        self.assertEqual((product.stock, product.available), (3, 1))
+
+    def test_payment_converts_holds_and_respects_others(self):
+        from apps.store.inventory import InsufficientStock, decrement_stock, order_quantities, reserve
+        reserve(self.first)
+        # An order without holds cannot take units held for another one
+        with self.assertRaises(InsufficientStock):
+            decrement_stock(order_quantities(self.second), order=self.second)
+        decrement_stock(order_quantities(self.first), order=self.first)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertFalse(self.first.reservations.exists())
+
+    def test_expired_holds_are_ignored_and_swept(self):
+        import datetime
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from apps.store.inventory import reserve
+        from apps.store.models import StockReservation
+        reserve(self.first)
+        StockReservation.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        reserve(self.second)
+        call_command('release_expired_reservations', stdout=StringIO())
+        self.assertEqual(list(StockReservation.objects.values_list('order_id', flat=True)), [self.second.id])
+
+    def test_cancelled_payment_releases_holds(self):
+        from apps.store.inventory import reserve
+        reserve(self.first)
+        session = self.client.session
+        session['pending_order_id'] = self.first.id
+        session.save()
+        self.client.get('/payment-cancelled/')
+        self.assertFalse(self.first.reservations.exists())
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        from apps.store.jobs import job
+        self.calls = []
+
+        @job('test_flaky')
+        def flaky(fail):
+            self.calls.append(fail)
+            if fail:
+                raise RuntimeError('boom')
+
+    def test_enqueued_after_commit_only(self):
+        from django.db import transaction
+        from apps.store.jobs import enqueue
+        from apps.store.models import Job
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                enqueue('test_flaky', fail=False)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    enqueue('test_flaky', fail=False)
+                    raise RuntimeError('rolled back')
+        except RuntimeError:
+            pass
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        from django.test import override_settings
+        from django.utils import timezone
+        from apps.store.jobs import enqueue, run_pending
+        from apps.store.models import Job
+        with override_settings(JOB_MAX_ATTEMPTS=2), self.captureOnCommitCallbacks(execute=True):
+            enqueue('test_flaky', fail=True)
+        self.assertEqual(run_pending(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        # Not due again until the backoff has passed
+        self.assertEqual(run_pending(), 0)
+        Job.objects.update(run_at=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('boom', job.last_error)
+
+    def test_order_confirmation_sent_by_worker(self):
+        import tempfile
+        from io import StringIO
+        from django.test import override_settings
+        from django.core import mail
+        from django.core.management import call_command
+        user = User.objects.create_user('mailme', 'mailme@test.com', 'password')
+        product = Product.objects.create(name="Boxed", price=100, stock=5)
+        order = Order.objects.create(customer=user.customer)
+        OrderItem.objects.create(order=order, product=product, quantity=1)
+        self.client.login(username='mailme', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/process-order/',
+                data=json.dumps({'form': {'total': '100'}, 'shipping': {
+                    'address': 'x', 'city': 'y', 'state': 'z', 'zipcode': '1'}}),
+                content_type='application/json')
+        self.assertEqual(len(mail.outbox), 0)
+        # The run also renders the invoice; keep it out of the real MEDIA_ROOT
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['mailme@test.com'])
+
+class InvoiceCacheTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # The PDF engine itself is not under test; count how often it runs
+        patcher = mock.patch('apps.store.invoices.render_pdf', side_effect=lambda html: b'%PDF-' + html[:20].encode())
+        self.render_pdf = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('invoiced', 'inv@test.com', 'password')
+        self.order = Order.objects.create(customer=self.user.customer, complete=True, transaction_id='TXN-INV-1')
+        for i in range(3):
+            product = Product.objects.create(name=f"Part {i}", price=100 + i)
+            OrderItem.objects.create(order=self.order, product=product, quantity=1)
+        self.client.login(username='invoiced', password='password')
+
+    def test_rendered_once_and_served_with_etag(self):
+        first = self.client.get(f'/invoice/{self.order.id}/')
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(b''.join(first.streaming_content).startswith(b'%PDF-'))
+        second = self.client.get(f'/invoice/{self.order.id}/')
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.render_pdf.call_count, 1)
+        not_modified = self.client.get(f'/invoice/{self.order.id}/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_render_uses_prefetched_items(self):
+        from apps.store.invoices import ensure_invoice, invoice_orders
+        order = invoice_orders().get(pk=self.order.pk)
+        with self.assertNumQueries(1):
+            ensure_invoice(order)
+
+    def test_render_job_and_rerender_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from apps.store.jobs import enqueue, run_pending
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue('render_invoice', order_id=self.order.id)
+        run_pending()
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.invoice_digest)
+        call_command('rerender_invoices', stdout=StringIO())
+        self.assertEqual(self.render_pdf.call_count, 1)
+        # A changed order renders a new file under a new digest
+        Order.objects.filter(pk=self.order.pk).update(transaction_id='TXN-INV-2')
+        call_command('rerender_invoices', stdout=StringIO())
+        self.assertEqual(self.render_pdf.call_count, 2)
+
+class OrderHistoryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('history', 'history@test.com', 'password')
+        self.products = [Product.objects.create(name=f"Item {i}", price=10 * (i + 1)) for i in range(3)]
+        self.client.login(username='history', password='password')
+
+    def add_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(customer=self.user.customer)
+            for product in self.products:
+                OrderItem.objects.create(order=order, product=product, quantity=2)
+            Order.objects.filter(pk=order.pk).update(
+                complete=True, transaction_id=Order.generate_transaction_id(), razorpay_payment_id='pay_test',
+            )
+
+    def count_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/orders/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_independent_of_order_count(self):
+        self.add_orders(1)
+        few = self.count_queries()
+        self.add_orders(9)
+        self.assertEqual(self.count_queries(), few)
+
+    def test_paginated(self):
+        from apps.store.views import ORDER_HISTORY_PAGE_SIZE
+        self.add_orders(ORDER_HISTORY_PAGE_SIZE + 1)
+        response = self.client.get('/orders/?page=2')
+        self.assertEqual(len(response.context['orders']), 1)
+        self.assertContains(response, f'Total: ₹{self.products[0].price * 2 + self.products[1].price * 2 + self.products[2].price * 2}')
+
+    def test_deleted_product_lines_purged_from_open_carts_only(self):
+        from apps.store.jobs import run_pending
+        self.add_orders(1)
+        paid = Order.objects.get()
+        cart = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=cart, product=self.products[0], quantity=1)
+        OrderItem.objects.create(order=cart, product=self.products[1], quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].delete()
+        response = self.client.get('/orders/')
+        self.assertNotContains(response, 'Item 0')
+        run_pending()
+        # The paid order keeps its line and the total it was paid at
+        self.assertEqual(OrderItem.objects.filter(order=paid, product__isnull=True).count(), 1)
+        self.assertEqual(Order.objects.get(pk=paid.pk).total_amount, paid.total_amount)
+        self.assertFalse(OrderItem.objects.filter(order=cart, product__isnull=True).exists())
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_amount, cart.item_count), (20, 1))
+
+class AdminOrderListTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('boss', 'boss@test.com', 'password')
+        self.products = [Product.objects.create(name=f"Gear {i}", price=50 + i) for i in range(2)]
+        self.client.login(username='boss', password='password')
+
+    def add_orders(self, count):
+        for i in range(count):
+            user = User.objects.create_user(f'buyer{Order.objects.count()}', '', 'password')
+            order = Order.objects.create(customer=user.customer)
+            for product in self.products:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+            Order.objects.filter(pk=order.pk).update(
+                complete=True, transaction_id=Order.generate_transaction_id(), razorpay_payment_id='pay_test',
+            )
+
+    def count_queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_fixed_query_count(self):
+        self.add_orders(1)
+        urls = ['/admin-orders/', '/admin/store/order/', '/admin/store/customer/', '/admin/store/orderitem/']
+        for url in urls:
+            self.count_queries(url)
+        few = [self.count_queries(url) for url in urls]
+        self.add_orders(8)
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+
+    def test_rows_show_annotated_counts_and_stored_totals(self):
+        from apps.store.views import ADMIN_ORDERS_PAGE_SIZE
+        self.add_orders(ADMIN_ORDERS_PAGE_SIZE + 1)
+        response = self.client.get('/admin-orders/')
+        orders = response.context['orders']
+        self.assertEqual(len(orders), ADMIN_ORDERS_PAGE_SIZE)
+        self.assertEqual(orders.paginator.count, ADMIN_ORDERS_PAGE_SIZE + 1)
+        self.assertEqual(orders[0].line_count, 2)
+        self.assertContains(response, '2 items')
+        self.assertContains(response, '$101')
+
+class DashboardMetricsTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.utils import timezone
+        from apps.store.reports import record_order_sales
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@test.com', 'password')
+        self.product = Product.objects.create(name="Widget", price=100, stock=50)
+        for quantity in (1, 2):
+            order = Order.objects.create(customer=User.objects.create_user(f'past{quantity}', '', 'password').customer)
+            OrderItem.objects.create(order=order, product=self.product, quantity=quantity)
+            order.complete = True
+            order.completed_at = timezone.now()
+            order.transaction_id = f'TXN-M-{quantity}'
+            order.save()
+            record_order_sales(order)
+
+    def test_single_order_pass(self):
+        from django.utils import timezone
+        from apps.store.metrics import SERIES_DAYS, compute_metrics
+        Order.objects.create(customer=self.user.customer)
+        # One grouped query over orders, the customer and product counts, and the daily rollups
+        with self.assertNumQueries(4):
+            metrics = compute_metrics()
+        self.assertEqual((metrics['total_revenue'], metrics['total_orders'], metrics['pending_orders']), (300, 2, 1))
+        self.assertEqual(metrics['total_customers'], 3)
+        self.assertEqual(len(metrics['series']), SERIES_DAYS)
+        self.assertEqual(metrics['series'][-1], {'date': timezone.localdate(), 'revenue': 300, 'units': 3, 'orders': 2})
+
+    def test_completion_updates_cached_snapshot(self):
+        from apps.store.metrics import dashboard_metrics
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=4)
+        self.assertEqual(dashboard_metrics()['pending_orders'], 1)
+        self.client.login(username='shopper', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/process-order/',
+                data=json.dumps({'form': {'total': '400'}, 'shipping': {
+                    'address': 'x', 'city': 'y', 'state': 'z', 'zipcode': '1'}}),
+                content_type='application/json')
+        with self.assertNumQueries(0):
+            metrics = dashboard_metrics()
+        self.assertEqual((metrics['total_revenue'], metrics['total_orders'], metrics['pending_orders']), (700, 3, 0))
+        self.assertEqual(metrics['series'][-1]['revenue'], 700)
+
+    def test_dashboard_view(self):
+        User.objects.create_superuser('chief', 'chief@test.com', 'password')
+        self.client.login(username='chief', password='password')
+        response = self.client.get('/admin-dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '₹300')
+
+class SalesRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('roller', 'roller@test.com', 'password')
+        self.phone = Product.objects.create(name="Phone", price=300, category="Phones", stock=50)
+        self.case = Product.objects.create(name="Case", price=20, category="Accessories", stock=50)
+        self.client.login(username='roller', password='password')
+
+    def checkout(self, **quantities):
+        order = Order.objects.create(customer=self.user.customer)
+        for name, quantity in quantities.items():
+            OrderItem.objects.create(order=order, product=getattr(self, name), quantity=quantity)
+        self.client.post('/process-order/',
+            data=json.dumps({'form': {'total': str(order.total_amount)}, 'shipping': {
+                'address': 'x', 'city': 'y', 'state': 'z', 'zipcode': '1'}}),
+            content_type='application/json')
+        return order
+
+    def test_completed_orders_increment_rollups(self):
+        from apps.store.models import DailySalesRollup
+        self.checkout(phone=1, case=2)
+        self.checkout(case=3)
+        rows = {r.product_id: r for r in DailySalesRollup.objects.all()}
+        self.assertEqual((rows[self.phone.id].units, rows[self.phone.id].revenue, rows[self.phone.id].category), (1, 300, 'Phones'))
+        self.assertEqual((rows[self.case.id].units, rows[self.case.id].revenue), (5, 100))
+
+    def test_backfill_and_consistency_check(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from apps.store.models import DailySalesRollup
+        self.checkout(phone=2, case=1)
+        recorded = list(DailySalesRollup.objects.order_by('product_id').values_list('product_id', 'units', 'revenue'))
+        DailySalesRollup.objects.all().delete()
+        call_command('backfill_sales_rollups', chunk_days=1, stdout=StringIO())
+        self.assertEqual(list(DailySalesRollup.objects.order_by('product_id').values_list('product_id', 'units', 'revenue')), recorded)
+        call_command('check_sales_rollups', stdout=StringIO())
+
+        DailySalesRollup.objects.filter(product=self.case).update(units=9)
+        with self.assertRaises(CommandError):
+            call_command('check_sales_rollups', stdout=StringIO())
+        call_command('check_sales_rollups', fix=True, stdout=StringIO())
+        self.assertEqual(DailySalesRollup.objects.get(product=self.case).units, 1)
+
+    def test_price_change_after_sale_is_not_a_mismatch(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from apps.store.models import DailySalesRollup
+        order = self.checkout(phone=2)
+        self.assertEqual(list(order.orderitem_set.values_list('unit_price', flat=True)), [300])
+        Product.objects.filter(pk=self.phone.pk).update(price=350)
+
+        out = StringIO()
+        call_command('check_sales_rollups', '--fix', stdout=out)
+        self.assertIn('rebuilt 0', out.getvalue())
+        self.assertEqual(DailySalesRollup.objects.get(product=self.phone).revenue, 600)
+
+    def test_sales_booked_on_payment_day(self):
+        import datetime
+        from django.utils import timezone
+        from apps.store.metrics import compute_metrics
+        from apps.store.models import DailySalesRollup
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.phone, quantity=1)
+        # The cart was opened well before the series window
+        Order.objects.filter(pk=order.pk).update(date_ordered=timezone.now() - datetime.timedelta(days=40))
+        self.client.post('/process-order/',
+            data=json.dumps({'form': {'total': '300'}, 'shipping': {
+                'address': 'x', 'city': 'y', 'state': 'z', 'zipcode': '1'}}),
+            content_type='application/json')
+        self.assertEqual(DailySalesRollup.objects.get().date, timezone.localdate())
+        today = compute_metrics()['series'][-1]
+        self.assertEqual((today['orders'], today['revenue']), (1, 300))
+
+    def test_report_reads_rollups_only(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.checkout(phone=1, case=4)
+        User.objects.create_superuser('analyst', 'analyst@test.com', 'password')
+        self.client.login(username='analyst', password='password')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin-sales/?days=7')
+        self.assertContains(response, 'Phones')
+        self.assertContains(response, '₹380')
+        self.assertFalse([q for q in ctx.captured_queries if 'store_orderitem' in q['sql']])
+
+class ViewCountBufferTest(TestCase):
+    def setUp(self):
+        from apps.store.counters import view_counts
+        self.buffer = view_counts
+        self.buffer.flush()
+        self.hot = Product.objects.create(name="Hot", price=100)
+        self.cold = Product.objects.create(name="Cold", price=100)
+
+    def test_views_are_buffered_until_flush(self):
+        from django.test import override_settings
+        with override_settings(PRODUCT_VIEW_FLUSH_INTERVAL=3600):
+            with self.assertNumQueries(0):
+                for _ in range(5):
+                    self.hot.increment_views()
+                self.cold.increment_views()
+        self.assertEqual(Product.objects.get(id=self.hot.id).views, 0)
+
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.buffer.flush(), 2)
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(Product.objects.get(id=self.hot.id).views, 5)
+        self.assertEqual(Product.objects.get(id=self.cold.id).views, 1)
+
+    def test_buffer_size_forces_flush(self):
+        from django.test import override_settings
+        with override_settings(PRODUCT_VIEW_FLUSH_INTERVAL=3600, PRODUCT_VIEW_BUFFER_SIZE=2):
+            self.hot.increment_views()
+            self.cold.increment_views()
+        self.assertEqual(Product.objects.get(id=self.cold.id).views, 1)
+
+    def test_started_buffer_flushes_in_background(self):
+        import threading
+        from unittest import mock
+        from django.test import override_settings
+        from apps.store.counters import ViewCountBuffer
+        buffer = ViewCountBuffer()
+        flushed = threading.Event()
+        with override_settings(PRODUCT_VIEW_FLUSH_INTERVAL=3600, PRODUCT_VIEW_BUFFER_SIZE=2), \
+                mock.patch.object(buffer, 'flush', side_effect=flushed.set):
+            buffer.start()
+            with self.assertNumQueries(0):
+                buffer.record(self.hot.id)
+                buffer.record(self.cold.id)
+            # A full buffer wakes the flusher instead of writing in the request
+            self.assertTrue(flushed.wait(5))
+
+class RecentlyViewedTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.store.recently_viewed import recent_views
+        cache.clear()
+        recent_views.flush()
+        self.user = User.objects.create_user('viewer', 'viewer@test.com', 'password')
+        self.products = [Product.objects.create(name=f"P{i}", price=100) for i in range(5)]
+
+    def tearDown(self):
+        from apps.store.recently_viewed import flush_recent_views
+        flush_recent_views()
+
+    def test_history_is_capped_and_newest_first(self):
+        from django.test import override_settings
+        from apps.store.recently_viewed import get_recently_viewed_ids, record_recent_view
+        with override_settings(RECENTLY_VIEWED_LIMIT=3, PRODUCT_VIEW_FLUSH_INTERVAL=3600):
+            for product in self.products:
+                record_recent_view(self.user.id, product.id)
+            record_recent_view(self.user.id, self.products[2].id)
+            with self.assertNumQueries(0):
+                ids = get_recently_viewed_ids(self.user.id)
+        self.assertEqual(ids, [self.products[2].id, self.products[4].id, self.products[3].id])
+
+    def test_flush_persists_and_prunes(self):
+        from django.test import override_settings
+        from apps.store.models_extended import RecentlyViewed
+        from apps.store.recently_viewed import record_recent_view, recent_views
+        with override_settings(RECENTLY_VIEWED_LIMIT=3, PRODUCT_VIEW_FLUSH_INTERVAL=3600):
+            for product in self.products:
+                record_recent_view(self.user.id, product.id)
+            self.assertEqual(RecentlyViewed.objects.count(), 0)
+            self.assertEqual(recent_views.flush(), 5)
+        kept = RecentlyViewed.objects.filter(user=self.user).values_list('product_id', flat=True)
+        self.assertEqual(list(kept), [p.id for p in reversed(self.products[2:])])
+
+    def test_failed_flush_keeps_views_for_retry(self):
+        from unittest import mock
+        from django.test import override_settings
+        from apps.store.models_extended import RecentlyViewed
+        from apps.store.recently_viewed import record_recent_view, recent_views
+        with override_settings(PRODUCT_VIEW_FLUSH_INTERVAL=3600):
+            record_recent_view(self.user.id, self.products[0].id)
+            with mock.patch('apps.store.recently_viewed.prune_history', side_effect=RuntimeError('down')), \
+                    self.assertLogs('apps.store.recently_viewed', level='ERROR'):
+                self.assertEqual(recent_views.flush(), 0)
+            record_recent_view(self.user.id, self.products[1].id)
+            self.assertEqual(recent_views.flush(), 2)
+        self.assertEqual(RecentlyViewed.objects.filter(user=self.user).count(), 2)
+
+    def test_flush_omits_upsert_target_without_backend_support(self):
+        from unittest import mock
+        from django.db import connection
+        from django.test import override_settings
+        from apps.store.models_extended import RecentlyViewed
+        from apps.store.recently_viewed import record_recent_view, recent_views
+        with override_settings(PRODUCT_VIEW_FLUSH_INTERVAL=3600):
+            record_recent_view(self.user.id, self.products[0].id)
+            with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                    mock.patch.object(RecentlyViewed.objects, 'bulk_create') as bulk_create:
+                recent_views.flush()
+        self.assertIsNone(bulk_create.call_args.kwargs['unique_fields'])
+
+    def test_product_page_shows_recently_viewed(self):
+        from django.test import override_settings
+        self.client.login(username='viewer', password='password')
+        with override_settings(PRODUCT_VIEW_FLUSH_INTERVAL=3600):
+            self.client.get(f'/product/{self.products[0].id}/')
+            response = self.client.get(f'/product/{self.products[1].id}/')
+        self.assertEqual([p.id for p in response.context['recently_viewed']], [self.products[0].id])
+        self.assertContains(response, 'Recently Viewed')
+        self.assertContains(response, f'href="/product/{self.products[0].id}/"')
+
+class SearchTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.store.search import get_search_backend
+        cache.clear()
+        self.phone = Product.objects.create(
+            name="Galaxy Phone", price=500, category="Phones",
+            description="<p>Android smartphone with a great camera</p>")
+        self.laptop = Product.objects.create(
+            name="Gaming Laptop", price=900, category="Laptops",
+            description="Fast laptop with a phone charging port")
+        self.case = Product.objects.create(name="Phone Case", price=20, category="Accessories")
+        get_search_backend().rebuild()
+
+    def test_ranks_name_matches_first(self):
+        from apps.store.search import search_products
+        ids = search_products('phone')
+        self.assertEqual(set(ids[:2]), {self.phone.id, self.case.id})
+        self.assertEqual(ids[2], self.laptop.id)
+
+    def test_prefix_and_category(self):
+        from apps.store.search import search_products
+        self.assertEqual(search_products('gam lap'), [self.laptop.id])
+        self.assertEqual(search_products('pho', category='Accessories'), [self.case.id])
+        self.assertEqual(search_products('smart'), [self.phone.id])
+
+    def test_rebuilds_after_max_age_without_version_change(self):
+        from unittest import mock
+        from apps.store.search import search_products
+        search_products('phone')
+        # Written by another worker: no signal here and, with a per-process
+        # cache, no version bump either
+        Product.objects.filter(pk=self.case.pk).update(name="Leather Cover")
+        self.assertEqual(search_products('leather'), [])
+        with mock.patch('apps.store.search.index_max_age', return_value=-1):
+            self.assertEqual(search_products('leather'), [self.case.id])
+
+    def test_signals_keep_index_current(self):
+        from apps.store.search import search_products
+        self.case.name = "Leather Cover"
+        self.case.save()
+        self.assertEqual(search_products('leather'), [self.case.id])
+        self.laptop.delete()
+        self.assertNotIn(self.laptop.id, search_products('phone'))
+
+    def test_database_fulltext_backend(self):
+        from apps.store.search import DatabaseFullTextBackend
+        backend = DatabaseFullTextBackend()
+        self.assertEqual(backend.search('gam lap'), [self.laptop.id])
+        self.assertIn(backend.search('phone')[0], (self.phone.id, self.case.id))
+
+    def test_store_view_orders_by_relevance(self):
+        response = Client().get('/store/', {'q': 'phone'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['sort_by'], 'relevance')
+        self.assertEqual(response.context['total_products'], 3)
+        self.assertEqual(list(response.context['products'])[-1], self.laptop)
+
+class SearchSuggestTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.store.search import suggestions
+        cache.clear()
+        self.phone = Product.objects.create(name="Galaxy Phone", price=500, category="Phones", views=50)
+        self.case = Product.objects.create(name="Phone Case", price=20, category="Accessories", views=5)
+        Product.objects.create(name="Gaming Laptop", price=900, category="Laptops")
+        suggestions.rebuild()
+
+    def test_prefix_matches_any_word(self):
+        from apps.store.search import suggest
+        names = [s['name'] for s in suggest('pho')]
+        self.assertEqual(names, ['Phones', 'Galaxy Phone', 'Phone Case'])
+
+    def test_incremental_refresh(self):
+        from apps.store.search import suggest
+        self.case.name = "Leather Cover"
+        self.case.save()
+        self.assertEqual([s['name'] for s in suggest('leath')], ['Leather Cover'])
+        self.assertNotIn('Phone Case', [s['name'] for s in suggest('pho')])
+        self.phone.delete()
+        self.assertEqual(suggest('pho'), [])
+
+    def test_endpoint_sets_cache_headers(self):
+        client = Client()
+        response = client.get('/api/search/suggest/', {'q': 'gam'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['suggestions'][0]['name'], 'Gaming Laptop')
+        self.assertIn('max-age', response['Cache-Control'])
+        repeat = client.get('/api/search/suggest/', {'q': 'gam'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+class FacetTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        Product.objects.create(name="Cheap Phone", price=500, stock=0, category="Phones")
+        Product.objects.create(name="Premium Phone", price=60000, stock=5, category="Phones")
+        Product.objects.create(name="Laptop", price=45000, stock=3, category="Laptops")
+
+    def test_counts_from_one_grouped_query(self):
+        from apps.store.facets import facet_rows, summarize
+        with self.assertNumQueries(1):
+            rows = facet_rows(Product.objects.all())
+        facets = summarize(rows, 'Phones')
+        self.assertEqual(facets['categories'], [('Laptops', 1), ('Phones', 2)])
+        self.assertEqual(facets['total'], 2)
+
+    def test_cached_facets_invalidated_on_product_write(self):
+        from apps.store.facets import cached_facet_rows, summarize
+        cached_facet_rows()
+        with self.assertNumQueries(0):
+            self.assertEqual(summarize(cached_facet_rows())['total'], 3)
+        Product.objects.create(name="Watch", price=2000, category="Watches")
+        self.assertEqual(summarize(cached_facet_rows())['total'], 4)
+
+    def test_store_view_counts_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        client = Client()
+        client.get('/store/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get('/store/', {'category': 'Phones'})
+        self.assertEqual(response.context['total_products'], 2)
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        for i in range(7):
+            Product.objects.create(name=f"P{i}", price=100 * (i % 3), views=i % 2)
+        # Legacy rows may have no creation time
+        Product.objects.filter(name='P3').update(created_at=None)
+
+    def _walk(self, sort):
+        from apps.store.pagination import keyset_page
+        seen, pages, cursor = [], [], None
+        while True:
+            page = keyset_page(Product.objects.all(), sort, 3, cursor)
+            pages.append(page)
+            seen += [p.id for p in page]
+            if not page.has_next:
+                return seen, pages
+            cursor = page.next_cursor
+
+    def test_forward_walk_matches_ordering(self):
+        from apps.store.pagination import keyset_page
+        expected = {
+            'price_low': list(Product.objects.order_by('price', 'id').values_list('id', flat=True)),
+            'popular': list(Product.objects.order_by('-views', '-id').values_list('id', flat=True)),
+        }
+        for sort, ids in expected.items():
+            self.assertEqual(self._walk(sort)[0], ids)
+        seen, pages = self._walk('-created_at')
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual(seen[-1], Product.objects.get(name='P3').id)
+
+        # Walking back from the last page returns the previous page
+        back = keyset_page(Product.objects.all(), '-created_at', 3, pages[-1].previous_cursor)
+        self.assertEqual([p.id for p in back], [p.id for p in pages[-2]])
+        self.assertIsNotNone(back.next_cursor)
+
+    def test_nulls_walk_both_ways(self):
+        from django.db.models import F
+        from apps.store.pagination import keyset_page
+        Product.objects.filter(name='P5').update(created_at=None)
+        expected = list(Product.objects.order_by(F('created_at').desc(nulls_last=True), '-id')
+                        .values_list('id', flat=True))
+        seen, pages = self._walk('-created_at')
+        self.assertEqual(seen, expected)
+
+        back, cursor = [], pages[-1].previous_cursor
+        while cursor:
+            page = keyset_page(Product.objects.all(), '-created_at', 3, cursor)
+            back = [p.id for p in page] + back
+            cursor = page.previous_cursor
+        self.assertEqual(back + [p.id for p in pages[-1]], expected)
+
+    def test_page_is_an_index_range(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from apps.store.pagination import keyset_page
+        products = Product.objects.filter(category='Phones')
+        Product.objects.update(category='Phones')
+        cursor = keyset_page(products, '-created_at', 3).next_cursor
+        with CaptureQueriesContext(connection) as ctx:
+            keyset_page(products, '-created_at', 3, cursor)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('IS NULL', sql.upper())
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as db:
+                db.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = ' '.join(row[-1] for row in db.fetchall())
+            self.assertIn('USING INDEX', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_no_count_query_and_bad_cursor(self):
+        from apps.store.pagination import keyset_page
+        with self.assertNumQueries(1):
+            page = keyset_page(Product.objects.all(), 'price_low', 3, 'tampered')
+        self.assertFalse(page.has_previous)
+        self.assertEqual(len(page), 3)
+
+    def test_api_and_store_cursor_mode(self):
+        client = Client()
+        first = client.get('/api/products/', {'sort': 'price_low', 'limit': 4}).json()
+        second = client.get('/api/products/', {'sort': 'price_low', 'limit': 4,
+                                                'cursor': first['next_cursor']}).json()
+        ids = [p['id'] for p in first['products'] + second['products']]
+        self.assertEqual(len(set(ids)), 7)
+        self.assertIsNone(second['next_cursor'])
+
+        response = client.get('/store/', {'sort': 'popular', 'cursor': ''})
+        self.assertTrue(response.context['keyset'])
+        self.assertEqual(len(response.context['products']), 7)
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.product = Product.objects.create(name="Phone", price=500, category="Phones")
+        Product.objects.create(name="Phone Case", price=50, category="Phones")
+
+    def test_product_write_bumps_version(self):
+        from apps.store.cache import catalog_key, catalog_version
+        version = catalog_version()
+        key = catalog_key('products', 'Phones', 'x' * 5000)
+        self.assertLess(len(key), 100)
+        self.product.price = 600
+        self.product.save()
+        self.assertEqual(catalog_version(), version + 1)
+        self.assertNotEqual(catalog_key('products', 'Phones', 'x' * 5000), key)
+
+        # View count flushes do not invalidate listings
+        self.product.save(update_fields=['views'])
+        self.assertEqual(catalog_version(), version + 1)
+
+    def test_store_page_served_from_cache(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        client = Client()
+        client.get('/store/', {'category': 'Phones'})
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get('/store/', {'category': 'Phones'})
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertFalse([q for q in ctx.captured_queries if 'store_product' in q['sql']])
+
+        Product.objects.create(name="Charger", price=20, category="Phones")
+        response = client.get('/store/', {'category': 'Phones'})
+        self.assertEqual(len(response.context['products']), 3)
+
+    def test_product_detail_cached(self):
+        from apps.store.cache import get_cached_product
+        get_cached_product(self.product.id)
+        with self.assertNumQueries(0):
+            product, related = get_cached_product(self.product.id)
+        self.assertEqual(product, self.product)
+        self.assertEqual(len(related), 1)
+        self.assertEqual(Client().get('/product/999999/').status_code, 404)
+
+class CachedCallTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.store.cache import reset_cache_stats
+        cache.clear()
+        reset_cache_stats()
+
+    def test_hits_and_misses(self):
+        from apps.store.cache import cached_call, cache_stats
+        calls = []
+        for _ in range(3):
+            self.assertEqual(cached_call('k', lambda: calls.append(1) or 42, ttl=300), 42)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache_stats()['misses'], 1)
+        self.assertEqual(cache_stats()['hits'], 2)
+
+    def test_concurrent_misses_compute_once(self):
+        import threading
+        import time
+        from apps.store.cache import cached_call, cache_stats
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cached_call('slow', slow)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(cache_stats()['coalesced'], 7)
+
+    def test_expired_entry_served_stale_while_refreshing(self):
+        from django.core.cache import cache
+        from apps.store.cache import cached_call, cache_stats
+        cached_call('k', lambda: 'old', ttl=0)
+        # Another process is already refreshing: callers keep getting the stale value
+        cache.add('lock:k', 1, 30)
+        self.assertEqual(cached_call('k', lambda: 'new'), 'old')
+        cache.delete('lock:k')
+        self.assertEqual(cached_call('k', lambda: 'new'), 'new')
+        self.assertEqual(cache_stats()['stale'], 2)
+
+class RateLimitMiddlewareTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import RequestFactory
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def _middleware(self, rules):
+        from django.http import HttpResponse
+        from django.test import override_settings
+        from apps.store.security_middleware import RateLimitMiddleware
+        with override_settings(RATE_LIMIT_RULES=rules):
+            return RateLimitMiddleware(lambda request: HttpResponse())
+
+    def test_blocks_after_budget_per_route(self):
+        middleware = self._middleware([('/l/', 3, 60), ('/', 100, 60)])
+        statuses = [middleware(self.factory.get('/l/')).status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        self.assertIn('Retry-After', middleware(self.factory.get('/l/')))
+        self.assertEqual(middleware(self.factory.get('/store/')).status_code, 200)
+        other_client = self.factory.get('/l/', REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(middleware(other_client).status_code, 200)
+
+    def test_static_and_media_exempt(self):
+        middleware = self._middleware([('/', 1, 60)])
+        for _ in range(5):
+            self.assertEqual(middleware(self.factory.get('/static/css/main.css')).status_code, 200)
+            self.assertEqual(middleware(self.factory.get('/images/products/a.png')).status_code, 200)
+
+    def test_previous_window_counts_toward_limit(self):
+        from unittest import mock
+        middleware = self._middleware([('/', 10, 60)])
+        with mock.patch('apps.store.security_middleware.time.time', return_value=6000 * 60 - 1):
+            for _ in range(10):
+                middleware(self.factory.get('/store/'))
+        # Just after the window rolls over nearly all of the last window still counts
+        with mock.patch('apps.store.security_middleware.time.time', return_value=6000 * 60 + 1):
+            self.assertEqual(middleware(self.factory.get('/store/')).status_code, 429)
+        with mock.patch('apps.store.security_middleware.time.time', return_value=6000 * 60 + 59):
+            self.assertEqual(middleware(self.factory.get('/store/')).status_code, 200)
+
+
+class RequestInspectionMiddlewareTest(TestCase):
+    def setUp(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from apps.store.security_middleware import RequestInspectionMiddleware
+        self.factory = RequestFactory()
+        self.middleware = RequestInspectionMiddleware(lambda request: HttpResponse())
+
+    def _status(self, params):
+        return self.middleware(self.factory.get('/store/', params)).status_code
+
+    def test_blocks_sql_injection_and_xss(self):
+        self.assertEqual(self._status({'q': "1; DROP TABLE users"}), 403)
+        self.assertEqual(self._status({'q': "x' union select 1 --"}), 403)
+        self.assertEqual(self._status({'a': 'ok', 'b': '<ScRipt>alert(1)</script>'}), 403)
+        self.assertEqual(self._status({'next': 'javascript:alert(1)'}), 403)
+
+    def test_inspects_every_value_of_repeated_keys(self):
+        self.assertEqual(self._status({'q': ['<script>alert(1)</script>', 'ok']}), 403)
+
+    def test_allows_ordinary_queries(self):
+        self.assertEqual(self._status({'q': 'select a phone', 'sort': 'price_low'}), 200)
+        self.assertEqual(self._status({'q': 'usb-c; cable', 'page': '2'}), 200)
+        # Keyword and separator in different parameters is not an injection
+        self.assertEqual(self._status({'q': 'update', 'note': 'a;b'}), 200)
+
+    def test_inspects_only_leading_characters(self):
+        padding = 'a' * self.middleware.INSPECT_MAX_LENGTH
+        self.assertEqual(self._status({'q': padding + '<script>'}), 200)
+
+
+class SecurityHeadersMiddlewareTest(TestCase):
+    def setUp(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from apps.store.security_middleware import SecurityHeadersMiddleware
+        self.factory = RequestFactory()
+        self.middleware = SecurityHeadersMiddleware(lambda request: HttpResponse())
+
+    def test_default_headers(self):
+        response = self.middleware(self.factory.get('/'))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+        self.assertIn("frame-ancestors 'none'", response['Content-Security-Policy'])
+        self.assertNotIn('nonce-', response['Content-Security-Policy'])
+
+    def test_store_pages_get_a_fresh_nonce(self):
+        first = self.factory.get('/store/')
+        second = self.factory.get('/product/1/')
+        csp = self.middleware(first)['Content-Security-Policy']
+        self.assertIn(f"'nonce-{first.csp_nonce}'", csp)
+        self.assertNotIn("script-src 'self' 'unsafe-inline'", csp)
+        self.middleware(second)
+        self.assertNotEqual(first.csp_nonce, second.csp_nonce)
+
+    def test_admin_policy_keeps_inline_scripts(self):
+        csp = self.middleware(self.factory.get('/admin/'))['Content-Security-Policy']
+        self.assertIn("script-src 'self' 'unsafe-inline'", csp)
+
+    def test_whitenoise_responses_untouched(self):
+        from io import BytesIO
+        from whitenoise.middleware import WhiteNoiseFileResponse
+        from apps.store.security_middleware import SecurityHeadersMiddleware
+        middleware = SecurityHeadersMiddleware(lambda request: WhiteNoiseFileResponse(BytesIO(b'x')))
+        response = middleware(self.factory.get('/static/css/main.css'))
+        self.assertNotIn('Content-Security-Policy', response)
+
+    def test_rendered_page_scripts_carry_nonce(self):
+        # Exercises the middleware as configured in MIDDLEWARE
+        response = self.client.get('/store/')
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        nonce = response.wsgi_request.csp_nonce
+        self.assertIn(f"'nonce-{nonce}'", response['Content-Security-Policy'])
+        self.assertContains(response, f'<script nonce="{nonce}">')
+
+    def test_policy_allows_every_external_asset(self):
+        from html.parser import HTMLParser
+        from urllib.parse import urlsplit
+
+        class Assets(HTMLParser):
+            def __init__(self):
+                super().__init__()
+                self.found = []
+
+            def handle_starttag(self, tag, attrs):
+                attrs = dict(attrs)
+                if tag == 'script' and attrs.get('src'):
+                    self.found.append(('script-src', attrs['src']))
+                elif tag == 'link' and attrs.get('rel') == 'stylesheet':
+                    self.found.append(('style-src', attrs['href']))
+
+        Product.objects.create(name="Lamp", price=40)
+        for path in ('/', '/store/', f'/product/{Product.objects.get().id}/'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            policy = {
+                name: sources
+                for name, *sources in (
+                    part.split() for part in response['Content-Security-Policy'].split(';') if part.strip()
+                )
+            }
+            parser = Assets()
+            parser.feed(response.content.decode())
+            external = [(d, urlsplit(url).hostname) for d, url in parser.found if urlsplit(url).hostname]
+            self.assertTrue(external)
+            for directive, host in external:
+                self.assertIn(host, policy[directive], f'{path}: {host} blocked by {directive}')
+            # Icon stylesheets load their webfonts from the same CDN
+            for directive, host in external:
+                if directive == 'style-src':
+                    self.assertIn(host, policy['font-src'], f'{path}: fonts from {host} blocked')
+
+    def test_inspection_and_rate_limit_installed(self):
+        from django.conf import settings
+        from django.core.cache import cache
+        cache.clear()
+        self.assertEqual(self.client.get('/store/?q=<script>alert(1)</script>').status_code, 403)
+        self.assertEqual(self.client.get('/store/?q=phone').status_code, 200)
+        self.assertTrue(any('RateLimitMiddleware' in path for path in settings.MIDDLEWARE))
@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .api_views import add_review, toggle_wishlist, get_wishlist, subscribe_newsletter
+from .api_views import add_review, toggle_wishlist, get_wishlist, subscribe_newsletter, search_suggest, product_list, update_cart
 
 urlpatterns = [
     path('', views.landing, name='landing'),
@@ -22,11 +22,15 @@ urlpatterns = [
     path('admin-edit-product/<int:product_id>/', views.admin_edit_product, name='admin_edit_product'),
     path('admin-delete-product/<int:product_id>/', views.admin_delete_product, name='admin_delete_product'),
     path('admin-orders/', views.admin_orders, name='admin_orders'),
+    path('admin-sales/', views.admin_sales_report, name='admin_sales_report'),
     
     # API Endpoints
     path('api/add-review/', add_review, name='add-review'),
     path('api/toggle-wishlist/', toggle_wishlist, name='toggle-wishlist'),
     path('api/wishlist/', get_wishlist, name='get-wishlist'),
     path('api/subscribe-newsletter/', subscribe_newsletter, name='subscribe-newsletter'),
+    path('api/search/suggest/', search_suggest, name='search-suggest'),
+    path('api/products/', product_list, name='product-list'),
+    path('api/cart/', update_cart, name='update-cart'),
     path('invoice/<int:order_id>/', views.generate_invoice_pdf, name='generate_invoice'),
 ]
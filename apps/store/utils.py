@@ -4,8 +4,11 @@ import string
 from django.conf import settings
 from django.core.mail import send_mail
 import json
+import logging
 from .models import Product, Customer, Order, OrderItem, ShippingAddress
 
+logger = logging.getLogger(__name__)
+
 # ─────────────────────────────────────────────
 #  DEMO / MOCK Razorpay client (no real API keys needed)
 # ─────────────────────────────────────────────
@@ -16,42 +19,84 @@ class _MockRazorpayClient:
 razorpay_client = _MockRazorpayClient()
 
 
-def cookieCart(request):
+def parse_cart_cookie(raw):
+    """Return ({product_id: quantity}, dropped) from the raw cart cookie"""
     try:
-        cart = json.loads(request.COOKIES['cart'])
-    except:
-        cart = {}
-
-    items = []
-    order = {'get_cart_items': 0, 'get_cart_total': 0, 'shipping': False}
-    cartItems = order['get_cart_items']
-
-    for i in cart:
+        cart = json.loads(raw) if raw else {}
+    except ValueError:
+        return {}, 0
+    if not isinstance(cart, dict):
+        return {}, 0
+
+    lines = {}
+    dropped = 0
+    for key, value in cart.items():
         try:
-            cartItems += cart[i]['quantity']
+            product_id = int(key)
+            quantity = int(value['quantity'])
+        except (TypeError, ValueError, KeyError):
+            dropped += 1
+            continue
+        if quantity <= 0:
+            dropped += 1
+            continue
+        lines[product_id] = quantity
+    return lines, dropped
 
-            product = Product.objects.get(id=i)
-            total = (product.price * cart[i]['quantity'])
 
-            order['get_cart_total'] += total
-            order['get_cart_items'] += cart[i]['quantity']
+def cookieCart(request):
+    """Resolve the anonymous cart cookie with a single product query.
 
-            item = {
-                'product': {
-                    'id': product.id,
-                    'name': product.name,
-                    'price': product.price,
-                    'imageURL': product.imageURL,
-                },
-                'quantity': cart[i]['quantity'],
-                'get_total': total
-            }
+    The result is memoized on the request so context processors and views
+    share one lookup. Lines that are malformed or point at deleted products
+    are dropped and reported in ``droppedItems``.
+    """
+    cached = getattr(request, '_cookie_cart', None)
+    if cached is not None:
+        return cached
+
+    lines, dropped = parse_cart_cookie(request.COOKIES.get('cart'))
 
-            items.append(item)
-        except:
-            pass
+    items = []
+    order = {'get_cart_items': 0, 'get_cart_total': 0, 'shipping': False}
 
-    return {'cartItems': cartItems, 'order': order, 'items': items}
+    if lines:
+        products = Product.objects.filter(id__in=lines).only('id', 'name', 'price', 'image')
+        products = {product.id: product for product in products}
+    else:
+        products = {}
+
+    for product_id, quantity in lines.items():
+        product = products.get(product_id)
+        if product is None:
+            dropped += 1
+            continue
+
+        total = product.price * quantity
+        order['get_cart_total'] += total
+        order['get_cart_items'] += quantity
+
+        items.append({
+            'product': {
+                'id': product.id,
+                'name': product.name,
+                'price': product.price,
+                'imageURL': product.imageURL,
+            },
+            'quantity': quantity,
+            'get_total': total,
+        })
+
+    if dropped:
+        logger.info(f"Dropped {dropped} invalid line(s) from cart cookie")
+
+    request._cookie_cart = {
+        'cartItems': order['get_cart_items'],
+        'order': order,
+        'items': items,
+        'droppedItems': dropped,
+    }
+    return request._cookie_cart
 
 
 def create_razorpay_order(amount_paise):
@@ -77,9 +122,9 @@ def verify_razorpay_signature(payment_data):
 
 
 def send_order_confirmation_email(email, order):
-    try:
-        subject = f'Order Confirmation - #{order.transaction_id}'
-        message = f'''
+    """Send the confirmation mail; errors propagate so the job queue can retry"""
+    subject = f'Order Confirmation - #{order.transaction_id}'
+    message = f'''
 Thank you for your order!
 
 Order ID: {order.transaction_id}
@@ -90,13 +135,9 @@ Your order has been confirmed and will be processed shortly.
 
 Thank you for shopping with us!
         '''
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [email],
-            fail_silently=True,
-        )
-    except Exception as e:
-        import sys
-        sys.stderr.write(f"Email error: {str(e)}\n")
\ No newline at end of file
+    send_mail(
+        subject,
+        message,
+        settings.DEFAULT_FROM_EMAIL,
+        [email],
+    )
@@ -1,20 +1,38 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, Http404
 from django.core.mail import send_mail
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Count, Prefetch
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_POST
 from django.db import transaction
 from django.core.exceptions import ValidationError
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
+from django.utils import timezone
 import json
 import datetime
+import logging
 import random
-from .utils import cookieCart, create_razorpay_order, verify_razorpay_signature, send_order_confirmation_email
+from .utils import cookieCart, create_razorpay_order, verify_razorpay_signature
+from .api_views import apply_cart_changes
+from .cart import invalidate_cart
+from .inventory import InsufficientStock, apply_holds, decrement_stock, order_quantities, release, reserve
+from .jobs import enqueue
+from .metrics import dashboard_metrics, record_completed_order
+from .reports import record_order_sales, sales_by_category, top_products
+from .recently_viewed import record_recent_view, recently_viewed_products
+from .search import search_products
+from .facets import cached_facet_rows, summarize
+from .cache import cached_call, catalog_key, get_cached_product
+from .pagination import CountedPaginator, keyset_page
 from .models import Product, Customer, Order, OrderItem, ShippingAddress
 
+logger = logging.getLogger(__name__)
+
+ORDER_HISTORY_PAGE_SIZE = 10
+ADMIN_ORDERS_PAGE_SIZE = 25
+
 # Import validators with fallback
 try:
     from .validators import validate_order_total, validate_stock_availability, sanitize_search_query
@@ -35,12 +53,8 @@ except ImportError:
 # Custom Admin Views
 @staff_member_required(login_url='/l/')
 def admin_dashboard(request):
-    context = {
-        'total_products': Product.objects.count(),
-        'total_orders': Order.objects.filter(complete=True).count(),
-        'total_customers': Customer.objects.count(),
-        'pending_orders': Order.objects.filter(complete=False).count(),
-    }
+    context = dict(dashboard_metrics())
+    context['max_daily_revenue'] = max([point['revenue'] for point in context['series']] + [1])
     return render(request, 'admin/dashboard.html', context)
 
 @staff_member_required(login_url='/l/')
@@ -98,11 +112,14 @@ def admin_delete_product(request, product_id):
 
 @staff_member_required(login_url='/l/')
 def admin_orders(request):
-    # ONLY show completed orders (paid orders)
+    # ONLY show completed orders (paid orders). Totals are stored on the order
+    # and the line count is annotated, so each row costs no extra queries.
     orders = Order.objects.filter(
         complete=True,
         razorpay_payment_id__isnull=False
-    ).order_by('-date_ordered')
+    ).select_related('customer').annotate(
+        line_count=Count('orderitem')
+    ).order_by('-date_ordered', '-id')
     
     if request.method == 'POST':
         # Handle order status updates
@@ -115,9 +132,31 @@ def admin_orders(request):
             messages.success(request, f'Order #{order.transaction_id} status updated to {new_status}!')
             return redirect('admin_orders')
     
-    context = {'orders': orders}
+    paginator = Paginator(orders, ADMIN_ORDERS_PAGE_SIZE)
+    orders_page = paginator.get_page(request.GET.get('page'))
+    
+    context = {'orders': orders_page}
     return render(request, 'admin/orders.html', context)
 
+@staff_member_required(login_url='/l/')
+def admin_sales_report(request):
+    # Reads only the daily rollups, never the raw order lines
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 366)
+    except ValueError:
+        days = 30
+    end = timezone.localdate() + datetime.timedelta(days=1)
+    start = end - datetime.timedelta(days=days)
+    
+    context = {
+        'days': days,
+        'categories': sales_by_category(start, end),
+        'products': top_products(start, end, limit=20),
+    }
+    context['total_revenue'] = sum(row['revenue'] or 0 for row in context['categories'])
+    context['total_units'] = sum(row['units'] or 0 for row in context['categories'])
+    return render(request, 'admin/sales_report.html', context)
+
 def landing(request):
     return render(request, 'store/landing.html')
 
@@ -125,15 +164,22 @@ def store(request):
     query = sanitize_search_query(request.GET.get('q', ''))
     category = request.GET.get('category', '')
     page_number = request.GET.get('page', 1)
-    sort_by = request.GET.get('sort', '-created_at')
+    sort_by = request.GET.get('sort', '')
     
     products = Product.objects.all()
     
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query)
-        )
+        # Category counts for a search cover every match, whatever the selected category
+        matched_ids = cached_call(catalog_key('search', query), lambda: search_products(query))
+        facets = summarize(cached_facet_rows(matched_ids), category)
+        if category:
+            ranked_ids = cached_call(catalog_key('search', query, category),
+                                     lambda: search_products(query, category=category))
+        else:
+            ranked_ids = matched_ids
+        products = products.filter(id__in=ranked_ids)
+    else:
+        facets = summarize(cached_facet_rows(), category)
     
     if category:
         products = products.filter(category=category)
@@ -144,21 +190,46 @@ def store(request):
         products = products.order_by('-price')
     elif sort_by == 'popular':
         products = products.order_by('-views')
+    elif query:
+        # Without an explicit sort, search results are listed by relevance
+        sort_by = 'relevance'
     else:
         products = products.order_by('-created_at')
+        sort_by = '-created_at'
     
-    paginator = Paginator(products, 12)
-    products_page = paginator.get_page(page_number)
+    cursor = request.GET.get('cursor')
+    keyset = sort_by != 'relevance' and (
+        cursor is not None or getattr(settings, 'STORE_KEYSET_PAGINATION', False)
+    )
+    page_key = catalog_key('store_page', query, category, sort_by, keyset, cursor if keyset else page_number)
+    
+    if sort_by == 'relevance':
+        paginator = Paginator(ranked_ids, 12)
+        products_page = paginator.get_page(page_number)
+        
+        def load_page():
+            page_products = Product.objects.in_bulk(products_page.object_list)
+            return [page_products[pid] for pid in products_page.object_list if pid in page_products]
+        products_page.object_list = cached_call(page_key, load_page)
+    elif keyset:
+        products_page = cached_call(page_key, lambda: keyset_page(products, sort_by, 12, cursor))
+    else:
+        # The count comes from the cached facets, so this costs no COUNT(*)
+        paginator = CountedPaginator(products, 12, count=facets['total'])
+        products_page = paginator.get_page(page_number)
+        products_page.object_list = cached_call(page_key, lambda: list(products_page.object_list))
+    
+    apply_holds(products_page)
     
-    categories = Product.objects.values_list('category', flat=True).distinct()
-
     context = {
         'products': products_page,
+        'keyset': keyset,
         'query': query,
-        'categories': categories,
+        'categories': [name for name, count in facets['categories']],
+        'facets': facets,
         'selected_category': category,
         'sort_by': sort_by,
-        'total_products': products.count(),
+        'total_products': facets['total'],
     }
     return render(request, 'store/store.html', context)
 
@@ -204,6 +275,7 @@ def checkout(request):
     if request.method == 'POST' and request.POST.get('make-payment-btn'):
         try:
             if request.user.is_authenticated:
+                reserve(order)
                 order_id = order.id
                 total_amount = order.get_cart_total
             else:
@@ -233,6 +305,7 @@ def checkout(request):
                         quantity=item['quantity']
                     )
                 
+                reserve(order_obj)
                 order_id = order_obj.id
                 total_amount = order_obj.get_cart_total
             
@@ -254,6 +327,8 @@ def checkout(request):
                 }
             else:
                 messages.error(request, 'Payment gateway error. Please try again.')
+        except InsufficientStock as e:
+            messages.error(request, e.messages[0])
         except Exception as e:
             messages.error(request, f'Error: {str(e)}')
         
@@ -267,26 +342,22 @@ def checkout(request):
     return render(request, 'store/checkout.html', context)
 
 def product_detail(request, pk):
-    product = get_object_or_404(Product, id=pk)
+    detail = get_cached_product(pk)
+    if detail is None:
+        raise Http404("No Product matches the given query.")
+    product, related_products = detail
+    apply_holds([product])
     product.increment_views()
     
-    related_products = Product.objects.filter(
-        category=product.category
-    ).exclude(id=product.id)[:4]
-    
+    recently_viewed = []
     if request.user.is_authenticated:
-        try:
-            from .models_extended import RecentlyViewed
-            RecentlyViewed.objects.update_or_create(
-                user=request.user,
-                product=product
-            )
-        except:
-            pass
+        recently_viewed = recently_viewed_products(request.user.id, exclude=product.id)
+        record_recent_view(request.user.id, product.id)
     
     context = {
         'product': product,
         'related_products': related_products,
+        'recently_viewed': recently_viewed,
     }
     return render(request, 'store/product_detail.html', context)
 
@@ -298,18 +369,24 @@ def order_history(request):
         user=request.user,
         defaults={'name': request.user.username, 'email': request.user.email}
     )
-    # ONLY show completed orders with successful payment
+    # ONLY show completed orders with successful payment. Totals are stored on
+    # the order and items arrive in one prefetch, so the page costs a fixed
+    # number of queries; lines of deleted products are purged by a job.
     orders = Order.objects.filter(
         customer=customer,
         complete=True,
         razorpay_payment_id__isnull=False
-    ).order_by('-date_ordered')
+    ).order_by('-date_ordered', '-id').prefetch_related(
+        Prefetch(
+            'orderitem_set',
+            queryset=OrderItem.objects.filter(product__isnull=False).select_related('product').order_by('id'),
+        )
+    )
     
-    # Clean up any order items with deleted products
-    for order in orders:
-        order.orderitem_set.filter(product__isnull=True).delete()
+    paginator = Paginator(orders, ORDER_HISTORY_PAGE_SIZE)
+    orders_page = paginator.get_page(request.GET.get('page'))
     
-    context = {'orders': orders}
+    context = {'orders': orders_page}
     return render(request, 'store/order_history.html', context)
 
 def wishlist(request):
@@ -318,6 +395,9 @@ def wishlist(request):
     return render(request, 'store/wishlist.html')
 
 def payment_cancelled(request):
+    pending_order_id = request.session.get('pending_order_id')
+    if pending_order_id:
+        release(pending_order_id)
     error_message = request.GET.get('error', 'Payment was cancelled. Your cart is still saved.')
     context = {'error_message': error_message}
     return render(request, 'store/payment_failed.html', context)
@@ -351,18 +431,16 @@ def payment_success(request):
                 return render(request, 'store/payment_failed.html', {'error_message': 'Order not found'})
             
             order_data = request.session.get('order_data', {})
+            # Converts the holds placed at checkout into a stock decrement
+            decrement_stock(order_quantities(order), order=order)
             order.transaction_id = Order.generate_transaction_id()
             order.razorpay_payment_id = razorpay_payment_id
             order.complete = True
+            order.completed_at = timezone.now()
             order.status = 'processing'
             order.save()
-            
-            for item in order.orderitem_set.all():
-                if item.product:
-                    try:
-                        item.product.reduce_stock(item.quantity)
-                    except:
-                        pass
+            order.freeze_line_prices()
+            invalidate_cart(order.customer.user_id if order.customer else None)
             
             if order_data.get('address'):
                 try:
@@ -377,11 +455,10 @@ def payment_success(request):
                 except:
                     pass
             
-            if order.customer.email:
-                try:
-                    send_order_confirmation_email(order.customer.email, order)
-                except:
-                    pass
+            enqueue('send_order_confirmation', order_id=order.id)
+            enqueue('render_invoice', order_id=order.id)
+            record_order_sales(order)
+            record_completed_order(order)
             
             request.session.pop('pending_order_id', None)
             request.session.pop('razorpay_order_id', None)
@@ -390,55 +467,28 @@ def payment_success(request):
             response = render(request, 'store/order_success.html', {'order': order})
             response.set_cookie('cart', '{}', max_age=0)
             return response
+    except InsufficientStock as e:
+        logger.error(f"Order {pending_order_id} paid ({razorpay_payment_id}) but out of stock: {e.messages[0]}")
+        return render(request, 'store/payment_failed.html', {
+            'error_message': f'{e.messages[0]}. Your order was not placed; please contact support '
+                             f'with payment ID {razorpay_payment_id}.'
+        })
     except Exception as e:
         return render(request, 'store/payment_failed.html', {'error_message': f'Error: {str(e)}'})
 
 @require_POST
 def updateItem(request):
-    if not request.user.is_authenticated:
-        return JsonResponse({"error": "User not authenticated"}, status=401)
-    
+    """Single +/- click on a cart line; see api_views.update_cart"""
     try:
         data = json.loads(request.body)
-        productId = data.get('productId')
-        action = data.get('action')
-        
-        if not productId or not action:
-            return JsonResponse({"error": "Invalid request"}, status=400)
-
-        with transaction.atomic():
-            customer, created = Customer.objects.get_or_create(
-                user=request.user,
-                defaults={'name': request.user.username, 'email': request.user.email}
-            )
-            product = Product.objects.select_for_update().get(id=productId)
-            # Get the most recent incomplete order or create a new one
-            order = Order.objects.filter(customer=customer, complete=False).first()
-            if not order:
-                order = Order.objects.create(customer=customer, complete=False)
-            orderItem, created = OrderItem.objects.get_or_create(order=order, product=product)
+    except ValueError:
+        return JsonResponse({"error": "Invalid request"}, status=400)
+    productId = data.get('productId')
+    action = data.get('action')
+    if not productId or action not in ('add', 'remove'):
+        return JsonResponse({"error": "Invalid request"}, status=400)
 
-            if action == 'add':
-                new_quantity = orderItem.quantity + 1
-                try:
-                    validate_stock_availability(product, new_quantity)
-                    orderItem.quantity = new_quantity
-                except Exception as e:
-                    return JsonResponse({"error": str(e)}, status=400)
-            elif action == 'remove':
-                orderItem.quantity = max(0, orderItem.quantity - 1)
-
-            if orderItem.quantity <= 0:
-                orderItem.delete()
-                return JsonResponse({"success": True, "message": "Item removed"})
-            else:
-                orderItem.save()
-                return JsonResponse({"success": True, "message": "Item updated", "quantity": orderItem.quantity})
-                
-    except Product.DoesNotExist:
-        return JsonResponse({"error": "Product not found"}, status=404)
-    except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
+    return apply_cart_changes(request, [{'productId': productId, 'delta': 1 if action == 'add' else -1}])
 
 @require_POST
 def processOrder(request):
@@ -487,20 +537,29 @@ def processOrder(request):
             try:
                 validate_order_total(submitted_total, order.get_cart_total)
             except Exception as e:
+                # Don't keep the guest order and lines created above
+                transaction.set_rollback(True)
                 return JsonResponse({"error": str(e)}, status=400)
+
+            # Adding to the cart only reads stock, so it is enforced here
+            try:
+                decrement_stock(order_quantities(order), order=order)
+            except InsufficientStock as e:
+                transaction.set_rollback(True)
+                return JsonResponse({"error": e.messages[0]}, status=400)
             
             order.transaction_id = Order.generate_transaction_id()
             order.complete = True
+            order.completed_at = timezone.now()
             order.status = 'processing'
             order.save()
+            order.freeze_line_prices()
+            invalidate_cart(customer.user_id)
             
-            for item in order.orderitem_set.all():
-                product = item.product
-                product.stock -= item.quantity
-                product.save()
-            
-            if customer.email:
-                send_order_confirmation_email(customer.email, order)
+            enqueue('send_order_confirmation', order_id=order.id)
+            enqueue('render_invoice', order_id=order.id)
+            record_order_sales(order)
+            record_completed_order(order)
 
             if order.shipping:
                 ShippingAddress.objects.create(
@@ -518,9 +577,10 @@ def processOrder(request):
         return JsonResponse({"error": str(e)}, status=500)
 
 def generate_invoice_pdf(request, order_id):
-    from django.template.loader import get_template
-    from django.http import HttpResponse
-    from xhtml2pdf import pisa
+    from django.http import FileResponse, HttpResponse
+    from django.utils.cache import get_conditional_response, patch_cache_control
+    from django.utils.http import quote_etag
+    from .invoices import InvoiceError, cached_invoice
     
     try:
         if request.user.is_authenticated:
@@ -531,16 +591,20 @@ def generate_invoice_pdf(request, order_id):
     except (Customer.DoesNotExist, Order.DoesNotExist):
         return HttpResponse("Order not found or not authorized.", status=404)
 
-    template_path = 'store/invoice_pdf.html'
-    context = {'order': order, 'items': order.orderitem_set.all(), 'request': request}
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="ElectroMart_Invoice_{order.transaction_id}.pdf"'
-    
-    template = get_template(template_path)
-    html = template.render(context)
-
-    pisa_status = pisa.CreatePDF(html, dest=response)
-    if pisa_status.err:
-        return HttpResponse('We had some errors <pre>' + html + '</pre>')
-    return response
\ No newline at end of file
+    try:
+        digest, path = cached_invoice(order)
+    except InvoiceError:
+        return HttpResponse("Invoice could not be generated. Please try again later.", status=500)
+
+    etag = quote_etag(digest)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=f'ElectroMart_Invoice_{order.transaction_id}.pdf',
+            content_type='application/pdf',
+        )
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
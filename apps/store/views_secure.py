@@ -11,6 +11,7 @@ from django.core.exceptions import ValidationError
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_protect
+from django.utils import timezone
 from django.utils.html import escape
 import json
 import logging
@@ -302,8 +303,10 @@ def payment_success(request):
             order.transaction_id = Order.generate_transaction_id()
             order.razorpay_payment_id = razorpay_payment_id
             order.complete = True
+            order.completed_at = timezone.now()
             order.status = 'processing'
             order.save()
+            order.freeze_line_prices()
             
             for item in order.orderitem_set.all():
                 if item.product:
@@ -29,6 +29,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'apps.store.security_middleware.SecurityHeadersMiddleware',
+    'apps.store.security_middleware.RateLimitMiddleware',
+    'apps.store.security_middleware.RequestInspectionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -123,6 +126,75 @@ CACHES = {
     }
 }
 CACHE_TTL = 60 * 15
+CACHE_STALE_TTL = 60
+CART_COUNT_TTL = 30  # seconds a navbar cart count may be reused, per worker
+
+PRODUCT_VIEW_FLUSH_INTERVAL = 60
+PRODUCT_VIEW_BUFFER_SIZE = 500
+RECENTLY_VIEWED_LIMIT = 12
+
+SEARCH_BACKEND = 'apps.store.search.InvertedIndexBackend'
+SEARCH_MAX_RESULTS = 1000
+SEARCH_SUGGEST_MAX_AGE = 300
+# In-process search indexes are rebuilt at least this often (seconds), so
+# products changed in another worker show up even without a shared cache
+SEARCH_INDEX_MAX_AGE = 300
+STORE_KEYSET_PAGINATION = False
+
+# How long checkout holds stock for an unpaid order (seconds). Expired holds
+# are ignored immediately and deleted by `manage.py release_expired_reservations`.
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Background jobs (apps.store.jobs), run by `manage.py run_jobs`. Failed jobs
+# are retried after JOB_RETRY_BACKOFF seconds, doubling up to the max delay.
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 30
+JOB_RETRY_MAX_DELAY = 60 * 60
+JOB_LEASE_SECONDS = 5 * 60
+
+# RateLimitMiddleware budgets: (path prefix, max requests, window seconds).
+# The first matching prefix wins; static and media paths are exempt.
+RATE_LIMIT_RULES = [
+    ('/l/', 20, 60 * 15),  # login and registration
+    ('/api/', 60, 60),
+    ('/', 100, 60),
+]
+
+# Third-party origins the base templates load from: Bootstrap (jsdelivr),
+# Font Awesome (cdnjs) and the Google Translate widget, which pulls in
+# further scripts, styles and API calls from googleapis/gstatic
+CSP_SCRIPT_HOSTS = ['cdn.jsdelivr.net', 'translate.google.com', 'translate.googleapis.com']
+CSP_STYLE_HOSTS = ['cdn.jsdelivr.net', 'cdnjs.cloudflare.com', 'translate.googleapis.com', 'www.gstatic.com']
+CSP_FONT_HOSTS = ['cdn.jsdelivr.net', 'cdnjs.cloudflare.com']
+CSP_CONNECT_HOSTS = ['translate.googleapis.com', 'translate-pa.googleapis.com']
+
+# SecurityHeadersMiddleware Content-Security-Policy: directive -> sources
+CONTENT_SECURITY_POLICY = {
+    'default-src': ["'self'"],
+    'script-src': ["'self'", "'unsafe-inline'", *CSP_SCRIPT_HOSTS],
+    'style-src': ["'self'", "'unsafe-inline'", *CSP_STYLE_HOSTS],
+    'img-src': ["'self'", 'data:', 'https:'],
+    'font-src': ["'self'", *CSP_FONT_HOSTS],
+    'connect-src': ["'self'", *CSP_CONNECT_HOSTS],
+    'frame-ancestors': ["'none'"],
+}
+
+# Per-path directive overrides, first matching prefix wins. '{nonce}' becomes
+# a per-request nonce (request.csp_nonce in templates).
+CONTENT_SECURITY_POLICY_OVERRIDES = [
+    # Django admin and the custom admin pages rely on inline scripts and
+    # handlers; keep them relaxed even if the base policy is tightened
+    ('/admin', {
+        'script-src': ["'self'", "'unsafe-inline'", *CSP_SCRIPT_HOSTS],
+        'style-src': ["'self'", "'unsafe-inline'", *CSP_STYLE_HOSTS],
+    }),
+    # Store pages: inline <script> blocks must carry the nonce; inline event
+    # handlers are still allowed through script-src-attr
+    (('/store/', '/product/', '/cart/', '/checkout/', '/orders/', '/wishlist/'), {
+        'script-src': ["'self'", "'nonce-{nonce}'", *CSP_SCRIPT_HOSTS],
+        'script-src-attr': ["'unsafe-inline'"],
+    }),
+]
 
 # Session Configuration
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
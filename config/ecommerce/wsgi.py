@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.ecommerce.settings')
 
 application = get_wsgi_application()
+
+# Product view counts are written by a background thread in served processes
+from apps.store.counters import view_counts  # noqa: E402
+
+view_counts.start()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Benchmark concurrent add-to-cart calls on a single hot product.
+
+Starts --calls threads at once, each adding the same product to its own
+shopper's cart through the cart service, and reports wall time, per-call
+latency and whether the resulting cart lines add up.
+
+Usage: python utils/scripts/benchmark_cart_concurrency.py [--calls 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import django
+from dotenv import load_dotenv
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, project_root)
+os.chdir(project_root)
+
+load_dotenv()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.ecommerce.settings')
+django.setup()
+
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+def add_to_cart(user, product_id, start, latencies, errors):
+    from apps.store.cart import apply_changes
+    start.wait()
+    began = time.perf_counter()
+    try:
+        apply_changes(user, [{'productId': product_id, 'delta': 1}])
+        latencies.append((time.perf_counter() - began) * 1000)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        connections.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    from django.contrib.auth.models import User
+    from apps.store.models import OrderItem, Product
+
+    if connection.vendor == 'sqlite':
+        # Threads need a shared on-disk database rather than in-memory ones.
+        # SQLite allows a single writer: take the write lock when each
+        # transaction begins and wait for it, instead of failing on upgrade.
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+        connection.settings_dict['OPTIONS']['timeout'] = 60
+        DatabaseWrapper._start_transaction_under_autocommit = (
+            lambda self: self.cursor().execute('BEGIN IMMEDIATE')
+        )
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        product = Product.objects.create(name='Hot product', price=999, stock=args.calls)
+        users = [User.objects.create(username=f'shopper{i}') for i in range(args.calls)]
+        connections.close_all()
+
+        start = threading.Barrier(args.calls + 1)
+        latencies, errors = [], []
+        threads = [
+            threading.Thread(target=add_to_cart, args=(user, product.id, start, latencies, errors))
+            for user in users
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        in_carts = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+        print(f'{args.calls} parallel add-to-cart calls on one product ({connection.vendor})')
+        print(f'  wall time        {elapsed * 1000:>10.1f} ms')
+        if latencies:
+            latencies.sort()
+            print(f'  latency p50      {statistics.median(latencies):>10.1f} ms')
+            print(f'  latency p95      {latencies[max(int(len(latencies) * 0.95) - 1, 0)]:>10.1f} ms')
+        print(f'  succeeded        {len(latencies):>10}')
+        print(f'  failed           {len(errors):>10}')
+        print(f'  units in carts   {in_carts:>10}')
+        for error in errors[:3]:
+            print(f'    {type(error).__name__}: {error}')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of per-request overhead of the security middlewares.
+
+Usage: python utils/scripts/benchmark_middleware.py [--requests 20000]
+"""
+import argparse
+import os
+import sys
+import time
+import django
+from dotenv import load_dotenv
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, project_root)
+os.chdir(project_root)
+
+load_dotenv()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.ecommerce.settings')
+django.setup()
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+
+def per_request_us(middleware, requests):
+    start = time.perf_counter()
+    for request in requests:
+        middleware(request)
+    return (time.perf_counter() - start) / len(requests) * 1e6
+
+
+def bench_rate_limit(count):
+    from django.test.utils import override_settings
+    from apps.store.security_middleware import RateLimitMiddleware
+
+    factory = RequestFactory()
+    with override_settings(RATE_LIMIT_RULES=[('/', 10 ** 9, 60)]):
+        middleware = RateLimitMiddleware(lambda request: HttpResponse())
+        baseline = lambda request: HttpResponse()
+        cases = [
+            ('single client', [factory.get('/store/') for _ in range(count)]),
+            ('1000 clients', [factory.get('/store/', REMOTE_ADDR=f'10.0.{i // 250 % 4}.{i % 250}')
+                              for i in range(count)]),
+            ('static (exempt)', [factory.get('/static/css/main.css') for _ in range(count)]),
+        ]
+        backend = settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1]
+        print(f'RateLimitMiddleware, {count} requests ({backend})')
+        print(f'  {"no middleware":<18}{per_request_us(baseline, cases[0][1]):>8.2f} us/request')
+        for label, requests in cases:
+            cache.clear()
+            print(f'  {label:<18}{per_request_us(middleware, requests):>8.2f} us/request')
+
+
+def bench_headers(count):
+    from apps.store.security_middleware import SecurityHeadersMiddleware
+
+    factory = RequestFactory()
+    middleware = SecurityHeadersMiddleware(lambda request: HttpResponse())
+    print(f'SecurityHeadersMiddleware, {count} requests')
+    for label, path in (('default', '/'), ('admin', '/admin/'), ('store (nonce)', '/store/')):
+        requests = [factory.get(path) for _ in range(count)]
+        print(f'  {label:<18}{per_request_us(middleware, requests):>8.2f} us/request')
+
+
+def bench_inspection(count):
+    from apps.store.security_middleware import RequestInspectionMiddleware
+
+    factory = RequestFactory()
+    middleware = RequestInspectionMiddleware(lambda request: HttpResponse())
+    print(f'RequestInspectionMiddleware, {count} requests')
+    for params in (1, 20, 200):
+        clean = {f'p{i}': f'value {i}' for i in range(params)}
+        # Triggers the pattern match on every value without being blocked
+        punctuated = {f'p{i}': f'a=b; c/d {i}' for i in range(params)}
+        requests = [factory.get('/store/', clean) for _ in range(count)]
+        # Parsing request.GET is paid by the view anyway; shown for reference
+        print(f'  {params:>3} params {"parse only":<12}{per_request_us(lambda r: r.GET, requests):>8.2f} us/request')
+        for label, query in (('clean', clean), ('punctuated', punctuated)):
+            requests = [factory.get('/store/', query) for _ in range(count)]
+            print(f'  {params:>3} params {label:<12}{per_request_us(middleware, requests):>8.2f} us/request')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+    bench_rate_limit(args.requests)
+    bench_headers(args.requests)
+    bench_inspection(args.requests // 10)
+
+
+if __name__ == '__main__':
+    main()
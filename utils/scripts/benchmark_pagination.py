@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Benchmark OFFSET vs keyset pagination of the product listing.
+
+Builds a synthetic catalog in a throwaway test database and times page 1 and
+a deep page for each mode.
+
+Usage: python utils/scripts/benchmark_pagination.py [--products 1000000] [--page 500]
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+import django
+from dotenv import load_dotenv
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, project_root)
+os.chdir(project_root)
+
+load_dotenv()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.ecommerce.settings')
+django.setup()
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+PER_PAGE = 12
+CATEGORIES = ['Smartphones', 'Laptops', 'Audio', 'Watches', 'Tablets', 'Accessories']
+
+
+def populate(count, batch_size=10000):
+    from apps.store.models import Product
+    now = timezone.now()
+    created = 0
+    # created_at is auto_now_add, which would stamp every row with the insert
+    # time and leave the -created_at cases sorting on a single value
+    created_at = Product._meta.get_field('created_at')
+    created_at.auto_now_add = False
+    try:
+        while created < count:
+            size = min(batch_size, count - created)
+            Product.objects.bulk_create([
+                Product(
+                    name=f'Product {created + i}',
+                    price=random.randint(100, 200000),
+                    stock=random.randint(0, 100),
+                    views=random.randint(0, 100000),
+                    category=random.choice(CATEGORIES),
+                    created_at=now - datetime.timedelta(seconds=random.randint(0, 10**8)),
+                )
+                for i in range(size)
+            ], batch_size=size)
+            created += size
+            print(f'  inserted {created}/{count}', end='\r')
+    finally:
+        created_at.auto_now_add = True
+    print()
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--page', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from apps.store.models import Product
+    from apps.store.pagination import CountedPaginator, cursor_for, keyset_page
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        print(f'Populating {args.products} products...')
+        populate(args.products)
+
+        print(f'\n{"sort":<28}{"offset p1":>12}{"offset p" + str(args.page):>14}'
+              f'{"keyset p1":>12}{"keyset p" + str(args.page):>14}   (median ms)')
+        cases = [
+            ('-created_at', None, ('-created_at', '-id')),
+            ('-created_at', CATEGORIES[0], ('-created_at', '-id')),
+            ('popular', None, ('-views', '-id')),
+            ('price_low', None, ('price', 'id')),
+        ]
+        for sort, category, order in cases:
+            base = Product.objects.all()
+            if category:
+                base = base.filter(category=category)
+            products = base.order_by(*order)
+            label = f'{sort} [{category}]' if category else sort
+
+            def offset_page(number):
+                # Offset mode pays a COUNT(*) plus OFFSET on every request
+                paginator = CountedPaginator(products, PER_PAGE, count=products.count())
+                return list(paginator.get_page(number))
+
+            # Cursor at the last row of the page before the deep page, as a
+            # shopper clicking "Next" would have received it
+            cursor = cursor_for(products[(args.page - 1) * PER_PAGE - 1], sort)
+
+            results = [
+                timed(lambda: offset_page(1), args.repeat),
+                timed(lambda: offset_page(args.page), args.repeat),
+                timed(lambda: list(keyset_page(base, sort, PER_PAGE)), args.repeat),
+                timed(lambda: list(keyset_page(base, sort, PER_PAGE, cursor)), args.repeat),
+            ]
+            print(f'{label:<28}' + ''.join(f'{r:>12.2f}' if i % 2 == 0 else f'{r:>14.2f}'
+                                          for i, r in enumerate(results)))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()